@@ -0,0 +1,93 @@
+"""Section building time per Docker blog post.
+
+Compares extractors.blog_post_fields, which walks the post content once, with
+the two selector passes DockerBlogSpider.parse_blog_post made before, on the
+saved posts in benchmarks/fixtures/docker_blog_*.html.
+
+    python benchmarks/bench_blog_post.py --iterations 50
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+from scrapy.http import HtmlResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neptunscraper.extractors import blog_post_fields  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+CONTENT = 'div.et_pb_module.et_pb_post_content'
+
+
+def selector_fields(response):
+    # the parse_blog_post of docker_blog_post.py before the extractor
+    paragraphs = []
+    for paragraph in response.css(f'{CONTENT} p'):
+        if paragraph.css('h1, h2, h3, h4, h5, h6'):
+            break
+        paragraphs.append(' '.join(paragraph.css('::text').getall()).strip())
+
+    sections = []
+    title = None
+    content = []
+    code = []
+    for element in response.css(f'{CONTENT} *'):
+        if element.root.tag in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+            if title is not None:
+                sections.append(dict(title=title, content='\n'.join(content).strip(), code=code))
+            title = element.css('::text').get().strip()
+            content = []
+            code = []
+        elif element.root.tag == 'p':
+            content.append(' '.join(element.css('::text').getall()).strip())
+        elif element.root.tag == 'div' and 'wp-block-syntaxhighlighter-code' in element.attrib.get('class', ''):
+            code.append(dict(content=element.css('td.code').get()))
+        elif element.root.tag == 'pre':
+            code.append(dict(content=element.css('pre').get()))
+    if title is not None:
+        sections.append(dict(title=title, content='\n'.join(content).strip(), code=code))
+    return dict(content='\n'.join(paragraphs), sections=sections)
+
+
+def walker_fields(response):
+    return blog_post_fields(element.root for element in response.css(CONTENT))
+
+
+def measure(parse, url, body, iterations):
+    response = HtmlResponse(url=url, body=body, encoding='utf-8')
+    parse(response)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        parse(response)
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    for path in sorted(glob.glob(os.path.join(FIXTURES, 'docker_blog_*.html'))):
+        with open(path, 'rb') as f:
+            body = f.read()
+        url = f'https://www.docker.com/blog/fixtures/{os.path.basename(path)}'
+        response = HtmlResponse(url=url, body=body, encoding='utf-8')
+        before = selector_fields(response)
+        after = walker_fields(response)
+        print(f"{os.path.basename(path)} ({len(body) // 1024} KiB, {len(after['sections'])} sections, "
+              f"{sum(len(section['code']) for section in after['sections'])} code blocks)")
+        if [section['content'] for section in before['sections']] != [section['content'] for section in after['sections']]:
+            print("  the section contents differ from the selector passes")
+
+        selectors = measure(selector_fields, url, body, args.iterations)
+        walker = measure(walker_fields, url, body, args.iterations)
+        print(f"  selector passes {selectors * 1000:8.3f} ms/post   single walk {walker * 1000:8.3f} ms/post   "
+              f"{selectors / walker:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Parse time per Docker Hub tags page.
+
+Compares extractors.image_fields, which walks the page once, with the CSS
+selectors the registry spiders used before, on the saved pages in
+benchmarks/fixtures/dockerhub_*_tags.html, with and without parsing the HTML.
+
+    python benchmarks/bench_extractors.py --iterations 200
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+from scrapy.http import HtmlResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neptunscraper import helpers  # noqa: E402
+from neptunscraper.extractors import image_fields  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def selector_fields(response):
+    # the parse_registry of dockerhub_queried_registry_search_auto.py before the extractor
+    fields = {}
+    name = response.css('h1.MuiTypography-h2::text, h2.MuiTypography-h2::text').get()
+    fields['name'] = name.strip() if name else None
+    fields['is_verified_publisher'] = bool(response.css('svg[data-testid="official-icon"]'))
+
+    downloads_elem = response.css('svg[data-testid="DownloadIcon"] + p.MuiTypography-body1::text').get()
+    fields['downloads'] = downloads_elem if downloads_elem else response.css(
+        'p.MuiTypography-body1:nth-child(3)::text').get()
+    if len(str(fields['downloads'])) > 4:
+        fields['downloads'] = None if downloads_elem else response.css(
+            'p.MuiTypography-body1:nth-child(4)::text').get()
+        if fields['downloads'] is None:
+            fields['downloads'] = response.css('p.MuiTypography-body1:nth-child(5)::text').get()
+
+    description = response.css('p[data-testid="description"]::text').get()
+    if not description:
+        description = response.css('p.MuiTypography-body1:nth-child(3)::text').get()
+        if str(fields['downloads']) in str(description):
+            description = None
+    fields['description'] = description
+
+    fields['chips'] = [chip.strip() for chip in response.css('span.MuiChip-labelSmall::text').getall() if
+                       chip.strip().lower() not in ["new", "image"]]
+    stars_text = response.css('svg[data-testid="StarOutlineIcon"] + span.MuiTypography-body1 strong::text').get()
+    fields['stars'] = stars_text.strip() if stars_text else None
+
+    tag_names = [
+        tag_item.css('a[data-testid="navToImage"]::text').get()
+        for tag_item in response.css('div[data-testid="repotagsTagListItem"]')
+    ]
+    fields['tags'] = helpers.group_tags(tag_names)
+    return fields
+
+
+def walker_fields(response):
+    return image_fields(response.selector.root)
+
+
+def measure(parse, url, body, iterations, reparse=True):
+    response = HtmlResponse(url=url, body=body, encoding='utf-8')
+    parse(response)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        # a new response parses the HTML again
+        parse(HtmlResponse(url=url, body=body, encoding='utf-8') if reparse else response)
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    for path in sorted(glob.glob(os.path.join(FIXTURES, 'dockerhub_*_tags.html'))):
+        with open(path, 'rb') as f:
+            body = f.read()
+        url = f'https://hub.docker.com/fixtures/{os.path.basename(path)}'
+        fields = walker_fields(HtmlResponse(url=url, body=body, encoding='utf-8'))
+        print(f"{os.path.basename(path)} ({len(body) // 1024} KiB, {sum(map(len, fields['tags'].values()))} tags)")
+        for label, reparse in (('with parsing', True), ('extraction only', False)):
+            selectors = measure(selector_fields, url, body, args.iterations, reparse)
+            walker = measure(walker_fields, url, body, args.iterations, reparse)
+            print(f"  {label:<16} css selectors {selectors * 1000:7.3f} ms/page   "
+                  f"single walk {walker * 1000:7.3f} ms/page   {selectors / walker:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Cold start time of the project.
+
+Every run starts a fresh interpreter and measures
+  * importing neptunscraper.settings,
+  * loading the settings and every spider module (what `scrapy list` does),
+  * constructing a crawler for a spider.
+Network access is blocked in the child, so a setting or spider that connects
+somewhere at import time fails the benchmark instead of slowing it down. Heavy
+modules that got imported on the way are listed.
+
+    python benchmarks/bench_startup.py --runs 10 --budget-ms 1500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('playwright', 'scrapy_playwright', 'psycopg', 'psycopg_pool', 'pyarrow', 'requests', 'zstandard')
+
+CHILD = r'''
+import json, socket, sys, time
+
+def no_network(*args, **kwargs):
+    raise RuntimeError("network access while loading the project")
+
+socket.socket.connect = no_network
+socket.socket.connect_ex = no_network
+socket.create_connection = no_network
+socket.getaddrinfo = no_network
+
+timings = {}
+started = time.perf_counter()
+import neptunscraper.settings
+timings['import_settings'] = time.perf_counter() - started
+
+from scrapy.crawler import CrawlerRunner
+from scrapy.spiderloader import SpiderLoader
+from scrapy.utils.project import get_project_settings
+
+started = time.perf_counter()
+settings = get_project_settings()
+spider_names = SpiderLoader.from_settings(settings).list()
+timings['load_spiders'] = time.perf_counter() - started
+
+started = time.perf_counter()
+CrawlerRunner(settings).create_crawler(sys.argv[1] or spider_names[0])
+timings['create_crawler'] = time.perf_counter() - started
+
+heavy = sorted(name for name in json.loads(sys.argv[2]) if name in sys.modules)
+print(json.dumps(dict(timings=timings, spiders=len(spider_names), heavy=heavy)))
+'''
+
+
+def run_once(spider):
+    env = dict(os.environ, SCRAPY_SETTINGS_MODULE='neptunscraper.settings')
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, spider or '', json.dumps(HEAVY_MODULES)],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"Loading the project failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--spider', help="spider to create a crawler for, the first one by default")
+    parser.add_argument('--budget-ms', type=float, help="fail if the median total exceeds this")
+    args = parser.parse_args()
+
+    runs = [run_once(args.spider) for _ in range(args.runs)]
+    stages = list(runs[0]['timings'])
+    for stage in stages + ['total']:
+        values = [
+            sum(run['timings'].values()) if stage == 'total' else run['timings'][stage]
+            for run in runs
+        ]
+        print(f"{stage:<16} median {statistics.median(values) * 1000:8.1f} ms   min {min(values) * 1000:8.1f} ms")
+    print(f"spiders          {runs[0]['spiders']}")
+    print(f"heavy imports    {', '.join(runs[-1]['heavy']) or '-'}")
+
+    total_ms = statistics.median(sum(run['timings'].values()) for run in runs) * 1000
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        sys.exit(f"Cold start took {total_ms:.1f} ms, more than the budget of {args.budget_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
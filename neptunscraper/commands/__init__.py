@@ -0,0 +1 @@
+# Custom scrapy commands of the project, registered through COMMANDS_MODULE.
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+
+from scrapy.commands import ScrapyCommand
+
+from neptunscraper.pipelines import SPOOL_WRITERS
+from neptunscraper.postgres import PostgresPool
+from neptunscraper.spool import find_segments, lock_directory, read_segment, seal_open_segments, segment_directories
+
+logger = logging.getLogger(__name__)
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+
+    def syntax(self):
+        return "[options] [directory]"
+
+    def short_desc(self):
+        return "Write spooled pipeline items left behind by a crawl to PostgreSQL"
+
+    def long_desc(self):
+        return (
+            "Replay the segments of the pipeline spool (SPOOL_DIR by default) into PostgreSQL "
+            "and remove every segment that was written. Job directories that are locked by a "
+            "running crawl are skipped."
+        )
+
+    def run(self, args, opts):
+        directory = args[0] if args else self.settings.get('SPOOL_DIR', 'spool')
+        if not os.path.isdir(directory):
+            logger.info(f"Nothing to replay, {directory} does not exist")
+            return
+
+        failed = asyncio.run(replay(self.settings, directory))
+        if failed:
+            self.exitcode = 1
+
+
+async def replay(settings, directory):
+    pool = PostgresPool(
+        settings.get('POSTGRES_DSN'),
+        min_size=1,
+        max_size=1,
+        migrate=settings.getbool('POSTGRES_MIGRATE', True),
+    )
+    await pool.open()
+
+    failed = 0
+    try:
+        for job_directory in list(segment_directories(directory)):
+            lock = lock_directory(job_directory, blocking=False)
+            if lock is None:
+                logger.info(f"Skipping {job_directory}, it is used by a running crawl")
+                continue
+            try:
+                seal_open_segments(job_directory)
+                failed += await replay_directory(pool, job_directory)
+            finally:
+                lock.close()
+    finally:
+        await pool.pool.close()
+
+    return failed
+
+
+async def replay_directory(pool, directory):
+    failed = 0
+    for path in find_segments(directory):
+        items = defaultdict(list)
+        for record in read_segment(path):
+            items[record['kind']].append(record['item'])
+
+        unknown = set(items) - set(SPOOL_WRITERS)
+        if unknown:
+            logger.error(f"Skipping {path}, it contains unknown record kinds: {sorted(unknown)}")
+            failed += 1
+            continue
+
+        try:
+            async with pool.connection() as conn:
+                for kind, batch in items.items():
+                    await SPOOL_WRITERS[kind](conn, batch)
+        except Exception as e:
+            logger.error(f"Error replaying {path}: {e}")
+            failed += 1
+            continue
+
+        os.remove(path)
+        logger.info(f"Replayed {sum(map(len, items.values()))} items from {path}")
+
+    return failed
@@ -0,0 +1,55 @@
+# Conversion of scraped HTML to text, run in the worker processes of the
+# HtmlToTextPipeline.
+#
+# The functions take and return plain strings, so they are cheap to send to a
+# worker. The module does not import Scrapy, a worker only loads lxml and html2text.
+
+import textwrap
+
+CODE_LINE_CLASS = 'line'
+
+
+def html_to_markdown(html):
+    import html2text
+
+    converter = html2text.HTML2Text()
+    # keep paragraphs on one line, wrapping would change with every release of html2text
+    converter.body_width = 0
+    converter.ignore_images = True
+    return converter.handle(html).strip()
+
+
+def normalize_code(code):
+    # syntax highlighters indent with non-breaking spaces
+    code = code.replace('\r\n', '\n').replace('\r', '\n').replace('\xa0', ' ')
+    lines = [line.rstrip() for line in code.split('\n')]
+    while lines and not lines[0]:
+        lines.pop(0)
+    while lines and not lines[-1]:
+        lines.pop()
+    return textwrap.dedent('\n'.join(lines))
+
+
+def code_to_text(html):
+    """Text of a code block, either a `pre` or the code cell of a syntax highlighter table."""
+    import lxml.html
+
+    root = lxml.html.fragment_fromstring(html, create_parent='div')
+    # the highlighter renders every line of code into its own div.line
+    lines = [
+        element.text_content()
+        for element in root.iter('div')
+        if CODE_LINE_CLASS in (element.get('class') or '').split()
+    ]
+    return normalize_code('\n'.join(lines) if lines else root.text_content())
+
+
+CONVERTERS = {
+    'markdown': html_to_markdown,
+    'code': code_to_text,
+}
+
+
+def convert(kind, values):
+    converter = CONVERTERS[kind]
+    return [converter(value) if value else value for value in values]
@@ -0,0 +1,107 @@
+# Incremental crawls of Docker Hub: detail pages are only rendered for images whose
+# search card or API record reports an update after the stored one.
+
+from datetime import datetime, timedelta, timezone
+
+from scrapy import signals
+from scrapy.utils.defer import deferred_from_coro
+
+from neptunscraper import helpers
+
+
+class ImageFreshness:
+    """Last known update time of every image in docker_images.
+
+    An image counts as changed if it is not stored yet, if it was last fetched more than
+    `max_age` ago, or if the reported update time is later than the stored one. Relative
+    times like "Updated 3 days ago" are only precise to their unit, so an update is
+    only trusted once it is more than one unit later than the stored time.
+    """
+
+    def __init__(self, pool, crawler, max_age=None):
+        self.pool = pool
+        self.crawler = crawler
+        self.max_age = max_age
+        self.known = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # spiders import this module, psycopg is only loaded for delta crawls
+        from neptunscraper.postgres import PostgresPool
+
+        max_age_days = crawler.settings.getfloat('DOCKERHUB_DELTA_MAX_AGE_DAYS', 7)
+        freshness = cls(
+            PostgresPool.from_crawler(crawler),
+            crawler,
+            max_age=timedelta(days=max_age_days) if max_age_days > 0 else None,
+        )
+        crawler.signals.connect(freshness.spider_opened, signal=signals.spider_opened)
+        return freshness
+
+    def spider_opened(self, spider):
+        # the engine waits for the deferred, so the state is loaded before the first response is parsed
+        return deferred_from_coro(self.load(spider))
+
+    async def load(self, spider):
+        await self.pool.open()
+        async with self.pool.connection() as conn:
+            async with conn.cursor(name='docker_images_freshness') as cursor:
+                await cursor.execute(
+                    "SELECT name, last_updated_at, coalesce(checked_at, updated_at) FROM docker_images"
+                )
+                async for name, last_updated_at, checked_at in cursor:
+                    self.known[name] = (last_updated_at, checked_at)
+        spider.logger.info(f"Loaded the update times of {len(self.known)} images for a delta crawl")
+
+    def is_changed(self, name, last_update, now=None):
+        now = now or datetime.now(timezone.utc)
+        stored = self.known.get(name)
+        if stored is None:
+            return self.count(True, 'new')
+
+        last_updated_at, checked_at = stored
+        if self.max_age is not None and now - checked_at > self.max_age:
+            return self.count(True, 'stale')
+
+        reported = helpers.parse_update_time(last_update, now)
+        if reported is None or last_updated_at is None:
+            return self.count(True, 'unknown')
+
+        updated_at, granularity = reported
+        if updated_at > last_updated_at + granularity:
+            return self.count(True, 'updated')
+        return self.count(False, 'unchanged')
+
+    def count(self, changed, reason):
+        # read here, the spider and this object are created before the crawler has its stats
+        stats = self.crawler.stats
+        stats.inc_value(f'delta/{reason}')
+        stats.inc_value('delta/scheduled' if changed else 'delta/skipped')
+        return changed
+
+
+class DeltaCrawlMixin:
+    """Gives a spider `is_changed(name, last_update)` for delta crawls.
+
+    Delta crawls are enabled with the `delta` spider argument (`-a delta=1`) or the
+    DOCKERHUB_DELTA_ENABLED setting, otherwise every image counts as changed.
+    """
+
+    freshness = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        delta = getattr(spider, 'delta', None)
+        if delta is None:
+            enabled = crawler.settings.getbool('DOCKERHUB_DELTA_ENABLED', False)
+        else:
+            enabled = str(delta).lower() in ('1', 'true', 'yes')
+        if enabled:
+            spider.freshness = ImageFreshness.from_crawler(crawler)
+        return spider
+
+    def is_changed(self, name, last_update):
+        if self.freshness is None or not name:
+            return True
+        return self.freshness.is_changed(name, last_update)
@@ -0,0 +1,201 @@
+# Plain HTTP access to the JSON endpoints behind the Docker Hub web app.
+#
+# Spiders mix in DockerHubApiMixin to fill DockerImageItem without rendering the
+# page in a browser. A request that fails falls back to the Playwright request
+# returned by the spider's `browser_fallback(request)`.
+
+import json
+import re
+from urllib.parse import quote, urlencode
+
+import scrapy
+
+from neptunscraper import helpers
+from neptunscraper.items import DockerImageItem
+
+API_HEADERS = {'Accept': 'application/json'}
+# "1 - 25 of 10,000 available results", "1-25 of 1.2K results"
+SEARCH_RESULT_COUNT = re.compile(r'\bof\s+([\d.,]+[KMB]?)\+?\s+(?:available\s+)?results', re.IGNORECASE)
+
+
+def repository_path(name):
+    # official images live in the "library" namespace
+    return name if '/' in name else f'library/{name}'
+
+
+def display_name(namespace, name):
+    return name if namespace in (None, 'library') else f'{namespace}/{name}'
+
+
+def image_item(repository, tag_names):
+    namespace = repository.get('namespace')
+    item = DockerImageItem()
+    item['name'] = display_name(namespace, repository.get('name'))
+    item['uploader'] = None if namespace == 'library' else namespace
+    item['is_official_image'] = namespace == 'library'
+    item['last_update'] = repository.get('last_updated')
+    item['last_updated_at'] = helpers.update_timestamp(repository.get('last_updated'))
+    item['description'] = repository.get('description') or None
+    item['chips'] = [category.get('name') for category in repository.get('categories') or [] if category.get('name')]
+    item['downloads'] = repository.get('pull_count')
+    item['stars'] = repository.get('star_count')
+    # the v2 endpoints tell neither, None is unknown rather than "not verified" or no pulls
+    item['is_verified_publisher'] = None
+    item['pulls_last_week'] = None
+    item['tags'] = helpers.group_tags(tag_names)
+    return item
+
+
+def image_name_from_path(path):
+    # "/_/python" -> "python", "/r/bitnami/python/tags" -> "bitnami/python"
+    parts = [part for part in path.split('?')[0].split('/') if part]
+    if parts and parts[-1] == 'tags':
+        parts.pop()
+    if parts[:1] == ['_']:
+        return '/'.join(parts[1:2]) or None
+    if parts[:1] == ['r']:
+        return '/'.join(parts[1:3]) or None
+    return None
+
+
+def image_page_url(name):
+    return f'https://hub.docker.com/r/{name}/tags' if '/' in name else f'https://hub.docker.com/_/{name}/tags'
+
+
+def search_url(query, page=1):
+    return f"https://hub.docker.com/search?{urlencode(dict(q=query or '', page=page))}"
+
+
+def search_result_count(response):
+    # None if the page does not tell, e.g. after a redesign of the search page
+    for element in response.xpath('//body//*[text()[contains(., "results")]]'):
+        match = SEARCH_RESULT_COUNT.search(element.xpath('normalize-space()').get())
+        if match:
+            return helpers.parse_count(match.group(1))
+    return None
+
+
+def search_pages(total, page_size, depth=None, max_pages=None):
+    """Numbers of the search pages after the first one for `total` results.
+
+    `depth` counts the pages followed after the first one, like the depth of a link.
+    """
+    if not total or not page_size:
+        return range(0)
+    last = -(-total // page_size)
+    if depth is not None:
+        last = min(last, 1 + int(depth))
+    if max_pages:
+        last = min(last, max_pages)
+    return range(2, last + 1)
+
+
+def load_json(response):
+    try:
+        return json.loads(response.text)
+    except (AttributeError, ValueError):
+        # e.g. an HTML error page instead of JSON
+        return None
+
+
+class DockerHubApiMixin:
+    """Fetches images and search results from the Docker Hub API.
+
+    API requests carry the image name (`dockerhub_image`) or the search query and
+    page (`dockerhub_search`) in their meta, `browser_fallback(request)` uses them
+    to build the equivalent Playwright request.
+    """
+
+    def api_url(self, path, **params):
+        base = self.settings.get('DOCKERHUB_API_URL', 'https://hub.docker.com').rstrip('/')
+        return f'{base}{path}?{urlencode(params)}' if params else f'{base}{path}'
+
+    def use_api(self):
+        mode = getattr(self, 'download_mode', None) or self.settings.get('DOCKERHUB_DOWNLOAD_MODE', 'api')
+        return mode == 'api'
+
+    def api_request(self, url, callback, meta, **kwargs):
+        # the API has its own download slot, the throttle of rendered pages does not apply to it
+        meta = dict(meta, download_slot=self.settings.get('DOCKERHUB_API_DOWNLOAD_SLOT', 'dockerhub-api'),
+                    autothrottle_dont_adjust_delay=True)
+        return scrapy.Request(
+            url,
+            headers=API_HEADERS,
+            callback=callback,
+            errback=self.api_errback,
+            meta=meta,
+            **kwargs
+        )
+
+    def api_repository_request(self, name, **kwargs):
+        return self.api_request(
+            self.api_url(f'/v2/repositories/{quote(repository_path(name))}/'),
+            self.parse_api_repository,
+            meta=dict(dockerhub_image=name),
+            **kwargs
+        )
+
+    def api_search_request(self, query, page=1, **kwargs):
+        return self.api_request(
+            self.api_url('/v2/search/repositories/', query=query, page=page,
+                         page_size=self.settings.getint('DOCKERHUB_SEARCH_PAGE_SIZE', 25)),
+            self.parse_api_search,
+            meta=dict(dockerhub_search=dict(query=query, page=page)),
+            **kwargs
+        )
+
+    def parse_api_repository(self, response):
+        repository = load_json(response)
+        if not isinstance(repository, dict) or not repository.get('name'):
+            yield from self.fall_back(response.request, "unexpected repository response")
+            return
+
+        name = response.meta['dockerhub_image']
+        if not self.is_changed(name, repository.get('last_updated')):
+            return
+        yield self.api_request(
+            self.api_url(f'/v2/repositories/{quote(repository_path(name))}/tags/',
+                         page_size=self.settings.getint('DOCKERHUB_TAGS_PAGE_SIZE', 100)),
+            self.parse_api_tags,
+            meta=dict(dockerhub_image=name),
+            cb_kwargs=dict(repository=repository),
+        )
+
+    def parse_api_tags(self, response, repository):
+        tags = load_json(response)
+        if not isinstance(tags, dict):
+            yield from self.fall_back(response.request, "unexpected tags response")
+            return
+
+        tag_names = [tag.get('name') for tag in tags.get('results') or []]
+        self.crawler.stats.inc_value('dockerhub_api/items')
+        yield image_item(repository, tag_names)
+
+    def parse_api_search(self, response):
+        search = load_json(response)
+        if not isinstance(search, dict):
+            yield from self.fall_back(response.request, "unexpected search response")
+            return
+        yield from self.parse_api_search_results(response, search)
+
+    def parse_api_search_results(self, response, search):
+        for result in search.get('results') or []:
+            # official images are listed without their "library/" namespace
+            yield self.api_repository_request(result['repo_name'])
+
+    def api_errback(self, failure):
+        yield from self.fall_back(failure.request, failure.value)
+
+    def fall_back(self, request, reason):
+        self.crawler.stats.inc_value('dockerhub_api/fallbacks')
+        self.logger.warning(f"Docker Hub API request failed, falling back to the browser: {request.url} ({reason})")
+        fallback = self.browser_fallback(request)
+        if fallback is not None:
+            yield fallback
+
+    def is_changed(self, name, last_update):
+        # overridden by DeltaCrawlMixin
+        return True
+
+    def browser_fallback(self, request):
+        raise NotImplementedError
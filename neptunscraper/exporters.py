@@ -0,0 +1,178 @@
+# Feed exporters of the project, registered in FEED_EXPORTERS.
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/feed-exports.html
+
+import logging
+
+from itemadapter import ItemAdapter
+from scrapy.exporters import BaseItemExporter
+
+from neptunscraper import helpers
+from neptunscraper.items import (
+    DockerBlogPostItem,
+    DockerDocsComposeCodeItem,
+    DockerDocsComposeItem,
+    DockerDocsComposeSectionItem,
+    DockerImageItem,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+
+def parquet_schemas():
+    string = pa.string()
+    strings = pa.list_(string)
+    return {
+        DockerImageItem: pa.schema([
+            ('name', string),
+            ('uploader', string),
+            ('is_official_image', pa.bool_()),
+            ('is_verified_publisher', pa.bool_()),
+            ('last_update', string),
+            ('last_updated_at', string),
+            ('description', string),
+            ('chips', strings),
+            ('downloads', pa.int64()),
+            ('pulls_last_week', pa.int64()),
+            ('stars', pa.int64()),
+            ('tags', pa.list_(pa.struct([('version', string), ('type_names', strings)]))),
+        ]),
+        DockerBlogPostItem: pa.schema([
+            ('url', string),
+            ('title', string),
+            ('authors', strings),
+            ('post_tags', strings),
+            ('content', string),
+            ('categories', strings),
+            ('posted_on', string),
+            ('sections', pa.list_(pa.struct([('title', string), ('content', string), ('code', strings)]))),
+        ]),
+        DockerDocsComposeItem: pa.schema([
+            ('url', string),
+            ('title', string),
+            ('section_count', pa.int64()),
+            ('code_count', pa.int64()),
+        ]),
+        DockerDocsComposeSectionItem: pa.schema([
+            ('title', string),
+            ('content', string),
+            ('url', string),
+            ('position', pa.int64()),
+        ]),
+        DockerDocsComposeCodeItem: pa.schema([
+            ('language', string),
+            ('code', string),
+            ('url', string),
+            ('position', pa.int64()),
+        ]),
+    }
+
+
+def image_row(item_data):
+    row = dict(item_data)
+    for field in ('downloads', 'pulls_last_week', 'stars'):
+        row[field] = helpers.parse_count(row.get(field))
+    row['tags'] = [
+        {'version': version, 'type_names': type_names}
+        for version, type_names in (row.get('tags') or {}).items()
+    ]
+    return row
+
+
+def blog_post_row(item_data):
+    row = dict(item_data)
+    row['sections'] = [
+        {
+            'title': section.get('title'),
+            'content': section.get('content'),
+            'code': [code.get('content') for code in section.get('code') or []],
+        }
+        for section in row.get('sections') or []
+    ]
+    return row
+
+
+ROW_CONVERTERS = {
+    DockerImageItem: image_row,
+    DockerBlogPostItem: blog_post_row,
+}
+
+
+class ParquetItemExporter(BaseItemExporter):
+    """Writes items as Parquet row groups of `row_group_size` rows.
+
+    A Parquet file has a single schema, so every feed must hold a single item
+    class, e.g. through the `item_classes` feed option. Items of another class
+    than the first one and items without a schema (e.g. dicts) are skipped with a
+    warning.
+    """
+
+    def __init__(self, file, row_group_size=10000, compression='zstd', **kwargs):
+        if pa is None:
+            raise RuntimeError("The parquet feed format requires pyarrow, install it with `poetry install -E parquet`")
+
+        super().__init__(dont_fail=True, **kwargs)
+        self.file = file
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.schemas = parquet_schemas()
+        self.item_class = None
+        self.schema = None
+        self.writer = None
+        self.rows = []
+        self.skipped = set()
+
+    @classmethod
+    def from_crawler(cls, crawler, file, *args, **kwargs):
+        kwargs.setdefault('row_group_size', crawler.settings.getint('FEED_PARQUET_ROW_GROUP_SIZE', 10000))
+        kwargs.setdefault('compression', crawler.settings.get('FEED_PARQUET_COMPRESSION', 'zstd'))
+        return cls(file, *args, **kwargs)
+
+    def export_item(self, item):
+        item_class = type(item)
+        if self.item_class is None:
+            if item_class not in self.schemas:
+                self.skip(item_class, "there is no Parquet schema for it")
+                return
+            self.item_class = item_class
+            self.schema = self.schemas[item_class]
+            if self.fields_to_export:
+                unknown = [name for name in self.fields_to_export if name not in self.schema.names]
+                if unknown:
+                    raise ValueError(f"The Parquet schema of {item_class.__name__} has no fields {unknown}")
+                self.schema = pa.schema([self.schema.field(name) for name in self.fields_to_export])
+        elif item_class is not self.item_class:
+            self.skip(item_class, f"the feed holds {self.item_class.__name__} items")
+            return
+
+        item_data = ItemAdapter(item).asdict()
+        convert = ROW_CONVERTERS.get(self.item_class)
+        self.rows.append(convert(item_data) if convert else item_data)
+        if len(self.rows) >= self.row_group_size:
+            self.write_row_group()
+
+    def skip(self, item_class, reason):
+        # once per class, a feed may skip thousands of items
+        if item_class not in self.skipped:
+            self.skipped.add(item_class)
+            logger.warning(f"Skipping {item_class.__name__} items in the Parquet feed, {reason}")
+
+    def finish_exporting(self):
+        if self.rows:
+            self.write_row_group()
+        if self.writer is not None:
+            self.writer.close()
+
+    def write_row_group(self):
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.file, self.schema, compression=self.compression)
+        batch = pa.RecordBatch.from_pylist(self.rows, schema=self.schema)
+        self.writer.write_table(pa.Table.from_batches([batch]))
+        self.rows = []
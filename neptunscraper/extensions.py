@@ -0,0 +1,105 @@
+# Extensions of the project, registered in EXTENSIONS.
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+from urllib.parse import urlsplit
+
+from scrapy.exceptions import NotConfigured
+from scrapy.extensions.throttle import AutoThrottle
+
+from neptunscraper.matchers import HostSuffixIndex
+
+# rough average transfer sizes, only used to estimate what an aborted request saved
+ESTIMATED_RESOURCE_BYTES = {
+    'image': 40_000,
+    'media': 500_000,
+    'font': 30_000,
+    'stylesheet': 20_000,
+    'script': 60_000,
+    'xhr': 5_000,
+    'fetch': 5_000,
+}
+
+
+class ResourcePolicy:
+    """Decides which requests of a rendered page are aborted in the browser.
+
+    Requests of a type outside `allowed_resource_types` (every type if it is empty)
+    and requests to one of the `blocked_domains` or their subdomains are aborted.
+    The page itself (a "document" request) is always loaded.
+    """
+
+    def __init__(self, stats, allowed_resource_types=(), blocked_domains=(), estimated_bytes=None):
+        self.stats = stats
+        self.allowed_resource_types = frozenset(allowed_resource_types)
+        self.blocked_domains = HostSuffixIndex(blocked_domains)
+        self.estimated_bytes = dict(ESTIMATED_RESOURCE_BYTES, **(estimated_bytes or {}))
+
+    @classmethod
+    def from_settings(cls, settings, stats):
+        policy = settings.getdict('PLAYWRIGHT_RESOURCE_POLICY')
+        return cls(
+            stats,
+            allowed_resource_types=policy.get('allowed_resource_types') or (),
+            blocked_domains=policy.get('blocked_domains') or (),
+            estimated_bytes=policy.get('estimated_bytes'),
+        )
+
+    def abort_reason(self, resource_type, url):
+        if resource_type == 'document':
+            return None
+        if self.allowed_resource_types and resource_type not in self.allowed_resource_types:
+            return 'resource_type'
+        if self.blocked_domains and self.blocked_domains.match(urlsplit(url).hostname):
+            return 'domain'
+        return None
+
+    def __call__(self, request):
+        # called by scrapy-playwright for every request of a page, see PLAYWRIGHT_ABORT_REQUEST
+        resource_type = request.resource_type
+        reason = self.abort_reason(resource_type, request.url)
+        if reason is None:
+            self.stats.inc_value(f'playwright_resources/allowed/{resource_type}')
+            return False
+
+        self.stats.inc_value(f'playwright_resources/aborted/{resource_type}')
+        self.stats.inc_value(f'playwright_resources/aborted_by/{reason}')
+        self.stats.inc_value(
+            f'playwright_resources/bytes_saved_estimate/{resource_type}',
+            self.estimated_bytes.get(resource_type, 0),
+        )
+        return True
+
+
+class ResourcePolicyExtension:
+    """Compiles PLAYWRIGHT_RESOURCE_POLICY of the running spider into PLAYWRIGHT_ABORT_REQUEST.
+
+    Spiders tune the policy through their custom_settings. An explicitly configured
+    PLAYWRIGHT_ABORT_REQUEST is left alone.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getdict('PLAYWRIGHT_RESOURCE_POLICY'):
+            raise NotConfigured
+        policy = ResourcePolicy.from_settings(crawler.settings, crawler.stats)
+        # extensions are created before the settings are frozen and the download handlers read them
+        crawler.settings.set('PLAYWRIGHT_ABORT_REQUEST', policy, priority='default')
+        return cls(policy)
+
+
+class SlotAutoThrottle(AutoThrottle):
+    """AutoThrottle that does not adjust the delay after requests with `autothrottle_dont_adjust_delay`.
+
+    The Docker Hub API requests have their own download slot and delay (DOWNLOAD_SLOTS),
+    AutoThrottle would raise it to at least DOWNLOAD_DELAY. Scrapy 2.12 reads the same meta key.
+    """
+
+    def _response_downloaded(self, response, request, spider):
+        if request.meta.get('autothrottle_dont_adjust_delay', False):
+            return
+        super()._response_downloaded(response, request, spider)
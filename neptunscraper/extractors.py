@@ -0,0 +1,175 @@
+# Extraction of items from rendered Docker Hub and Docker blog pages, shared by the spiders.
+#
+# The XPath expressions are compiled once when the module is imported. The page is
+# walked once, lxml only hands the elements of the interesting tags to Python, and
+# every element that carries a field is handled where it is met.
+
+from lxml import etree
+
+from neptunscraper import helpers
+from neptunscraper.items import DockerBlogPostCodeItem, DockerBlogPostSectionItem, DockerImageItem
+
+STRONG_TEXT = etree.XPath('(.//strong)[1]/text()')
+CODE_CELL = etree.XPath('(.//td[contains(concat(" ", normalize-space(@class), " "), " code ")])[1]')
+
+IGNORED_CHIPS = {'new', 'image'}
+IMAGE_PAGE_TAGS = ('svg', 'p', 'span', 'div', 'a', 'h1', 'h2')
+HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+
+def has_class(element, class_name):
+    return class_name in (element.get('class') or '').split()
+
+
+def next_element(element):
+    sibling = element.getnext()
+    while sibling is not None and not isinstance(sibling.tag, str):
+        sibling = sibling.getnext()
+    return sibling
+
+
+def nth_child(element):
+    return 1 + sum(1 for sibling in element.itersiblings(preceding=True) if isinstance(sibling.tag, str))
+
+
+def first_text(texts):
+    return texts[0] if texts else None
+
+
+def strip(value):
+    value = value.strip() if value else None
+    return value or None
+
+
+def text_content(element):
+    # the text nodes joined like ' '.join(selector.css('::text').getall())
+    return ' '.join(element.itertext()).strip()
+
+
+def outer_html(element):
+    return etree.tostring(element, method='html', encoding='unicode', with_tail=False)
+
+
+def image_fields(root):
+    """Fields of a DockerImageItem found on a repository tags page.
+
+    The fallbacks match the layouts the spiders selected with nth-child selectors:
+    a `p.MuiTypography-body1` at position 3 to 5 holds the downloads if it looks
+    like a count, the one at position 3 holds the description otherwise.
+    """
+    fields = dict(
+        name=None,
+        is_official_image=False,
+        is_verified_publisher=False,
+        description=None,
+        chips=[],
+        downloads=None,
+        stars=None,
+    )
+    # None until the name of the tag list item is found
+    tag_names = []
+    body_paragraphs = {}
+
+    for element in root.iter(*IMAGE_PAGE_TAGS):
+        tag = element.tag
+        if tag == 'svg':
+            test_id = element.get('data-testid')
+            if test_id == 'official-icon':
+                fields['is_official_image'] = True
+            elif test_id == 'verified_publisher-icon':
+                fields['is_verified_publisher'] = True
+            elif test_id == 'DownloadIcon' and fields['downloads'] is None:
+                sibling = next_element(element)
+                if sibling is not None and sibling.tag == 'p' and has_class(sibling, 'MuiTypography-body1'):
+                    fields['downloads'] = strip(sibling.text)
+            elif test_id == 'StarOutlineIcon' and fields['stars'] is None:
+                sibling = next_element(element)
+                if sibling is not None and sibling.tag == 'span' and has_class(sibling, 'MuiTypography-body1'):
+                    fields['stars'] = strip(first_text(STRONG_TEXT(sibling)))
+        elif tag == 'p':
+            if element.get('data-testid') == 'description':
+                if fields['description'] is None:
+                    fields['description'] = strip(element.text)
+            elif has_class(element, 'MuiTypography-body1'):
+                position = nth_child(element)
+                if 3 <= position <= 5 and position not in body_paragraphs:
+                    body_paragraphs[position] = strip(element.text)
+        elif tag == 'span':
+            if has_class(element, 'MuiChip-labelSmall'):
+                chip = strip(element.text)
+                if chip and chip.lower() not in IGNORED_CHIPS:
+                    fields['chips'].append(chip)
+        elif tag == 'div':
+            if element.get('data-testid') == 'repotagsTagListItem':
+                tag_names.append(None)
+        elif tag == 'a':
+            # the link of a tag list item follows the item in document order
+            if element.get('data-testid') == 'navToImage' and tag_names and tag_names[-1] is None:
+                tag_names[-1] = element.text
+        elif tag in ('h1', 'h2'):
+            if fields['name'] is None and has_class(element, 'MuiTypography-h2'):
+                fields['name'] = strip(element.text)
+
+    if fields['downloads'] is None:
+        for position in (3, 4, 5):
+            if helpers.parse_count(body_paragraphs.get(position)) is not None:
+                fields['downloads'] = body_paragraphs[position]
+                break
+    if fields['description'] is None:
+        description = body_paragraphs.get(3)
+        if description and description != fields['downloads']:
+            fields['description'] = description
+
+    fields['tags'] = helpers.group_tags(tag_names)
+    return fields
+
+
+def extract_image_item(response, **fields):
+    # the selector already holds the parsed document, it is not parsed again
+    item = DockerImageItem(**fields)
+    item.update(image_fields(response.selector.root))
+    return item
+
+
+def blog_post_fields(containers):
+    """Intro content and sections of the post content containers of a blog post.
+
+    The intro are the paragraphs before the first heading, every heading starts a
+    section holding the paragraphs and code blocks up to the next heading. A code
+    block is either a syntax highlighter block, of which the code cell is kept, or
+    a `pre`, both as HTML. Code before the first heading belongs to no section.
+    """
+    intro = []
+    sections = []
+    section = None
+
+    containers = list(containers)
+    for container in containers:
+        if any(ancestor in containers for ancestor in container.iterancestors()):
+            # already walked with the container around it
+            continue
+        walker = etree.iterwalk(container, events=('start',))
+        for _, element in walker:
+            tag = element.tag
+            if not isinstance(tag, str) or element is container:
+                continue
+
+            if tag in HEADINGS:
+                section = DockerBlogPostSectionItem(title=text_content(element), content=[], code=[])
+                sections.append(section)
+            elif tag == 'p':
+                (intro if section is None else section['content']).append(text_content(element))
+            elif tag == 'pre' or tag == 'div' and has_class(element, 'wp-block-syntaxhighlighter-code'):
+                if section is not None:
+                    code = element if tag == 'pre' else first_text(CODE_CELL(element))
+                    section['code'].append(DockerBlogPostCodeItem(
+                        content=None if code is None else outer_html(code),
+                    ))
+            else:
+                continue
+            # headings, paragraphs and code blocks are read as a whole, nothing is nested in them
+            walker.skip_subtree()
+
+    for section in sections:
+        section['content'] = '\n'.join(section['content']).strip()
+    return dict(content='\n'.join(intro), sections=sections)
@@ -0,0 +1,283 @@
+# Crawl frontier shared by the crawler processes of several scrapyd nodes.
+#
+# Enable it with SCHEDULER = "neptunscraper.frontier.PostgresFrontierScheduler".
+# Requests are stored in crawl_frontier, keyed by their crawl and fingerprint, so
+# a request enqueued by any worker of a crawl is downloaded once. Workers lease
+# pending requests with FOR UPDATE SKIP LOCKED. A lease that is not completed
+# before it expires, e.g. because its worker died, is taken over by another worker.
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import pickle
+import socket
+
+import psycopg
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.request import request_from_dict
+
+from neptunscraper.postgres import PostgresPool
+
+logger = logging.getLogger(__name__)
+
+# a completed request can only be queued again by the worker that completed it,
+# which is how retries of the RetryMiddleware (dont_filter) get back into the frontier
+INSERT_REQUEST = """
+    INSERT INTO crawl_frontier (crawl, fingerprint, priority, request)
+    VALUES (%(crawl)s, %(fingerprint)s, %(priority)s, %(request)s)
+    ON CONFLICT (crawl, fingerprint) DO UPDATE SET
+        state = 'pending', priority = EXCLUDED.priority, request = EXCLUDED.request,
+        attempts = 0, lease_owner = NULL, lease_expires_at = NULL
+    WHERE %(requeue)s AND crawl_frontier.lease_owner = %(worker)s
+"""
+
+CLAIM_REQUESTS = """
+    UPDATE crawl_frontier frontier SET
+        state = 'leased', attempts = frontier.attempts + 1, lease_owner = %(worker)s,
+        lease_expires_at = now() + %(lease_seconds)s * interval '1 second'
+    FROM (
+        SELECT fingerprint FROM crawl_frontier
+        WHERE crawl = %(crawl)s AND state <> 'done'
+            AND (state = 'pending' OR lease_expires_at < now() AND attempts < %(max_attempts)s)
+        ORDER BY priority DESC, id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ) claimed
+    WHERE frontier.crawl = %(crawl)s AND frontier.fingerprint = claimed.fingerprint
+    RETURNING frontier.fingerprint, frontier.priority, frontier.request
+"""
+
+COMPLETE_REQUESTS = """
+    UPDATE crawl_frontier SET state = 'done', lease_expires_at = NULL
+    WHERE crawl = %s AND fingerprint = ANY(%s) AND lease_owner = %s
+"""
+
+RELEASE_REQUESTS = """
+    UPDATE crawl_frontier SET
+        state = 'pending', attempts = attempts - 1, lease_owner = NULL, lease_expires_at = NULL
+    WHERE crawl = %s AND fingerprint = ANY(%s) AND lease_owner = %s AND state = 'leased'
+"""
+
+# requests that are queued, or leased and either still running or to be taken over
+COUNT_PENDING = """
+    SELECT count(*) FROM crawl_frontier
+    WHERE crawl = %s AND state <> 'done'
+        AND (state = 'pending' OR lease_expires_at >= now() OR attempts < %s)
+"""
+
+
+class PostgresFrontierScheduler:
+    """Scheduler whose queue and dupefilter are the crawl_frontier table.
+
+    Workers with the same crawl name (the `frontier` spider argument, FRONTIER_CRAWL
+    or the spider name) work on the same crawl. Use a new name for every run, a
+    request that was completed in a crawl is not downloaded again in it.
+
+    The Scrapy scheduler interface is synchronous, so requests are written and
+    leased in the background: a worker keeps up to FRONTIER_PREFETCH leased requests
+    in memory. Requests that cannot be pickled stay in a local queue of the worker.
+    """
+
+    def __init__(self, crawler, pool, crawl=None, lease_seconds=600, prefetch=16, max_attempts=3,
+                 poll_interval=0.5):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.pool = pool
+        self.crawl = crawl
+        self.lease_seconds = lease_seconds
+        self.prefetch = prefetch
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.worker = f'{socket.gethostname()}-{os.getpid()}'
+        self.spider = None
+        self.fingerprinter = None
+        # heaps of (-priority, sequence, fingerprint, request)
+        self.leased = []
+        self.local = []
+        self.sequence = itertools.count()
+        self.seen = set()
+        # fingerprint -> request handed to the engine
+        self.in_flight = {}
+        self.inserts = []
+        self.completed = set()
+        self.remote_pending = 0
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            crawler,
+            PostgresPool.from_crawler(crawler),
+            crawl=settings.get('FRONTIER_CRAWL'),
+            lease_seconds=settings.getint('FRONTIER_LEASE_SECONDS', 600),
+            prefetch=settings.getint('FRONTIER_PREFETCH', 16),
+            max_attempts=settings.getint('FRONTIER_MAX_ATTEMPTS', 3),
+            poll_interval=settings.getfloat('FRONTIER_POLL_INTERVAL', 0.5),
+        )
+
+    def open(self, spider):
+        self.spider = spider
+        self.fingerprinter = self.crawler.request_fingerprinter
+        self.crawl = getattr(spider, 'frontier', None) or self.crawl or spider.name
+        return deferred_from_coro(self._open())
+
+    async def _open(self):
+        await self.pool.open()
+        await self.sync()
+        self.task = asyncio.ensure_future(self.run())
+        logger.info(f"Sharing the crawl frontier {self.crawl!r} as {self.worker} "
+                    f"({self.remote_pending} pending requests)", extra={'spider': self.spider})
+
+    def close(self, reason):
+        return deferred_from_coro(self._close())
+
+    async def _close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        # leased requests that were not started go back to the other workers
+        unstarted = [fingerprint for _, _, fingerprint, _ in self.leased]
+        self.leased = []
+        await self.sync(claim=False, release=unstarted)
+
+    def __len__(self):
+        return len(self.leased) + len(self.local) + len(self.inserts) + self.remote_pending
+
+    def has_pending_requests(self):
+        # the pending requests of the other workers count, they may still be taken over
+        return bool(self.leased or self.local or self.inserts or self.remote_pending)
+
+    def enqueue_request(self, request):
+        fingerprint = self.fingerprinter.fingerprint(request)
+        if not request.dont_filter and fingerprint in self.seen:
+            self.stats.inc_value('frontier/duplicates', spider=self.spider)
+            return False
+        self.seen.add(fingerprint)
+
+        try:
+            data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        except (ValueError, TypeError, AttributeError, pickle.PicklingError) as e:
+            # e.g. a live Playwright page in the meta of a retried request
+            logger.debug(f"Keeping unserializable request {request} in memory: {e}", extra={'spider': self.spider})
+            heapq.heappush(self.local, (-request.priority, next(self.sequence), fingerprint, request))
+            self.stats.inc_value('frontier/unserializable', spider=self.spider)
+            self.stats.inc_value('scheduler/enqueued/memory', spider=self.spider)
+        else:
+            self.inserts.append(dict(
+                crawl=self.crawl,
+                fingerprint=fingerprint,
+                priority=request.priority,
+                request=data,
+                requeue=request.dont_filter,
+                worker=self.worker,
+            ))
+            # queued again before its completion was written, e.g. a retry
+            self.completed.discard(fingerprint)
+            self.stats.inc_value('scheduler/enqueued/frontier', spider=self.spider)
+        self.stats.inc_value('scheduler/enqueued', spider=self.spider)
+        return True
+
+    def next_request(self):
+        if not self.leased and not self.local:
+            return None
+        if not self.local or self.leased and self.leased[0] < self.local[0]:
+            _, _, fingerprint, request = heapq.heappop(self.leased)
+            self.in_flight[fingerprint] = request
+            self.stats.inc_value('scheduler/dequeued/frontier', spider=self.spider)
+        else:
+            _, _, _, request = heapq.heappop(self.local)
+            self.stats.inc_value('scheduler/dequeued/memory', spider=self.spider)
+        self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+        return request
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.sync()
+            except psycopg.OperationalError as e:
+                # the writes are kept and retried with the next sync
+                logger.warning(f"Could not sync the crawl frontier: {e}", extra={'spider': self.spider})
+
+    def sweep_completed(self):
+        # a request is complete once the engine is done with it, whether it was downloaded,
+        # answered from the cache, ignored or failed; a retry is queued again as a new request
+        slot = self.engine_slot()
+        if slot is None:
+            return
+        for fingerprint, request in list(self.in_flight.items()):
+            if request not in slot.inprogress:
+                del self.in_flight[fingerprint]
+                self.completed.add(fingerprint)
+
+    async def sync(self, claim=True, release=()):
+        self.sweep_completed()
+        inserts, self.inserts = self.inserts, []
+        completed, self.completed = self.completed, set()
+        limit = self.prefetch - len(self.leased)
+        # refill once half of the prefetched requests are used
+        claim = claim and limit >= max(self.prefetch // 2, 1)
+
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.transaction():
+                    async with conn.cursor() as cursor:
+                        if completed:
+                            await cursor.execute(COMPLETE_REQUESTS, (self.crawl, list(completed), self.worker))
+                        if inserts:
+                            await cursor.executemany(INSERT_REQUEST, inserts)
+                            self.stats.inc_value('frontier/written', len(inserts), spider=self.spider)
+                        if release:
+                            await cursor.execute(RELEASE_REQUESTS, (self.crawl, list(release), self.worker))
+                        claimed = []
+                        if claim:
+                            await cursor.execute(CLAIM_REQUESTS, dict(
+                                crawl=self.crawl,
+                                worker=self.worker,
+                                lease_seconds=self.lease_seconds,
+                                max_attempts=self.max_attempts,
+                                limit=limit,
+                            ))
+                            claimed = await cursor.fetchall()
+                        await cursor.execute(COUNT_PENDING, (self.crawl, self.max_attempts))
+                        (remote_pending,) = await cursor.fetchone()
+        except BaseException:
+            self.inserts[:0] = inserts
+            self.completed |= completed
+            raise
+
+        self.remote_pending = remote_pending
+        for fingerprint, priority, data in claimed:
+            fingerprint = bytes(fingerprint)
+            try:
+                request = request_from_dict(pickle.loads(data), spider=self.spider)
+            except Exception as e:
+                # e.g. a callback that was renamed since the request was written
+                logger.error(f"Could not restore a request of the crawl frontier: {e!r}", extra={'spider': self.spider})
+                self.stats.inc_value('frontier/undecodable', spider=self.spider)
+                self.completed.add(fingerprint)
+                continue
+            self.seen.add(fingerprint)
+            heapq.heappush(self.leased, (-priority, next(self.sequence), fingerprint, request))
+        if claimed:
+            self.stats.inc_value('frontier/leased', len(claimed), spider=self.spider)
+            self.wake_engine()
+
+    def engine_slot(self):
+        engine = self.crawler.engine
+        if engine is None:
+            return None
+        # renamed to _slot in later Scrapy releases
+        return getattr(engine, 'slot', None) or getattr(engine, '_slot', None)
+
+    def wake_engine(self):
+        # the engine only asks for requests every few seconds when it is idle
+        slot = self.engine_slot()
+        if slot is not None:
+            slot.nextcall.schedule()
@@ -1,7 +1,15 @@
-import requests
+import hashlib
+import json
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
 
 
 def fetch_and_parse_proxies(url):
+    # imported here, so loading the project does not pay for requests
+    import requests
+
     response = requests.get(url)
     response.raise_for_status()
 
@@ -12,8 +20,134 @@ def fetch_and_parse_proxies(url):
     return proxies
 
 
-def should_abort_request(request):
-    return (
-        request.resource_type == "image"
-        or ".jpg" in request.url or "font" in request.url
-    )
+def page_method(method, *args, **kwargs):
+    # a plain spec that can be pickled with the request (JOBDIR, the crawl frontier),
+    # the PageMethodSpecMiddleware builds the PageMethod when the request is downloaded
+    return {'method': method, 'args': list(args), 'kwargs': kwargs}
+
+
+def build_page_methods(specs):
+    # scrapy_playwright is only imported once a Playwright request is downloaded
+    from scrapy_playwright.page import PageMethod
+
+    def build(spec):
+        if not isinstance(spec, dict):
+            return spec
+        return PageMethod(spec['method'], *spec.get('args', ()), **spec.get('kwargs', {}))
+
+    if isinstance(specs, dict):
+        return {name: build(spec) for name, spec in specs.items()}
+    return [build(spec) for spec in specs]
+
+
+COUNT_MULTIPLIERS = {'K': 10 ** 3, 'M': 10 ** 6, 'B': 10 ** 9}
+
+
+def parse_count(value):
+    # Docker Hub abbreviates counts, e.g. "1B+", "500K+", "10M", "1.2K" or "4,210"
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    text = str(value).strip().upper().replace(',', '').rstrip('+')
+    multiplier = COUNT_MULTIPLIERS.get(text[-1:], 1)
+    if multiplier != 1:
+        text = text[:-1]
+
+    try:
+        return int(Decimal(text) * multiplier)
+    except (InvalidOperation, OverflowError, ValueError):
+        return None
+
+
+RELATIVE_TIME_UNITS = {
+    'second': timedelta(seconds=1),
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'month': timedelta(days=30),
+    'year': timedelta(days=365),
+}
+RELATIVE_TIME = re.compile(r'(a few|an?|\d+)\s+(second|minute|hour|day|week|month|year)s?\s+ago')
+
+
+def parse_update_time(value, now=None):
+    # "Updated 3 days ago" -> (now - 3 days, 1 day), the update happened up to a day before that;
+    # a timestamp of the API, e.g. "2024-06-07T08:09:10.123456Z" -> (timestamp, 0)
+    if not value:
+        return None
+    now = now or datetime.now(timezone.utc)
+    text = str(value).strip().lower()
+
+    match = RELATIVE_TIME.search(text)
+    if match:
+        count, unit = match.groups()
+        count = int(count) if count.isdigit() else 1
+        granularity = RELATIVE_TIME_UNITS[unit]
+        return now - count * granularity, granularity
+    if 'just now' in text:
+        return now, RELATIVE_TIME_UNITS['minute']
+
+    try:
+        timestamp = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp, timedelta(0)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def update_timestamp(value, now=None):
+    # ISO timestamp of the update time estimated by parse_update_time, rounded down to its
+    # granularity, so "3 days ago" gives the same timestamp in every crawl of that day
+    parsed = parse_update_time(value, now)
+    if not parsed:
+        return None
+    timestamp, granularity = parsed
+    if granularity:
+        timestamp -= (timestamp - EPOCH) % granularity
+    return timestamp.isoformat()
+
+
+def parse_timestamp(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def content_hash(data, exclude=()):
+    # canonical JSON, so the digest does not depend on key order
+    if exclude:
+        data = {key: value for key, value in data.items() if key not in exclude}
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).digest()
+
+
+def stable_id(key):
+    # equals md5(key)::uuid in PostgreSQL
+    return uuid.UUID(hashlib.md5(key.encode('utf-8')).hexdigest())
+
+
+def split_tag(tag_name):
+    # "3.12-slim" -> ("3.12", "slim"), the suffix after the last dash groups the tags
+    if tag_name and '-' in tag_name:
+        parts = tag_name.rsplit('-', 1)
+        if len(parts) == 2:
+            return parts[0], parts[1]
+
+    return None
+
+
+def group_tags(tag_names):
+    tags = {}
+    for tag_name in tag_names:
+        tag_version = split_tag(tag_name)
+        if tag_version:
+            type_name, version = tag_version
+            tags.setdefault(version, []).append(type_name)
+        else:
+            tags.setdefault('default', []).append(tag_name or "")
+    return tags
@@ -0,0 +1,176 @@
+# HTTP cache storage for rendered responses, see HTTPCACHE_STORAGE.
+#
+# Responses are kept zstd compressed in a single SQLite file. A cache hit is
+# returned by the HttpCacheMiddleware before the request reaches the Playwright
+# download handler, so the page is not rendered again.
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+def page_methods_spec(page_methods):
+    # PageMethods hold their method name (or a callable), arguments and keyword arguments
+    if isinstance(page_methods, dict):
+        page_methods = [page_methods[name] for name in sorted(page_methods)]
+
+    spec = []
+    for page_method in page_methods or ():
+        if isinstance(page_method, dict):
+            # a spec of helpers.page_method
+            spec.append([page_method['method'], page_method.get('args', []), page_method.get('kwargs', {})])
+            continue
+        method = getattr(page_method, 'method', page_method)
+        spec.append([
+            method if isinstance(method, str) else getattr(method, '__qualname__', repr(method)),
+            getattr(page_method, 'args', ()),
+            getattr(page_method, 'kwargs', {}),
+        ])
+    return spec
+
+
+def encode_headers(headers):
+    return {
+        key.decode('latin1'): [value.decode('latin1') for value in values]
+        for key, values in headers.items()
+    }
+
+
+def decode_headers(data):
+    return Headers({
+        key.encode('latin1'): [value.encode('latin1') for value in values]
+        for key, values in data.items()
+    })
+
+
+class SqliteZstdCacheStorage:
+    """Keeps responses in HTTPCACHE_DIR/HTTPCACHE_SQLITE_FILE.
+
+    Entries are keyed on the request fingerprint and the `playwright_page_methods`
+    of the request, since they decide what the rendered page contains. Entries older
+    than HTTPCACHE_EXPIRATION_SECS (0 keeps them forever) are not returned, and the
+    least recently used entries are evicted once the compressed responses take
+    more than HTTPCACHE_MAX_BYTES (0 for no limit).
+    """
+
+    def __init__(self, settings):
+        if zstandard is None:
+            raise RuntimeError("The SQLite cache storage requires zstandard, install it with `poetry install -E cache`")
+
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.path = os.path.join(self.cachedir, settings.get('HTTPCACHE_SQLITE_FILE', 'responses.sqlite'))
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.max_bytes = settings.getint('HTTPCACHE_MAX_BYTES', 0)
+        self.compressor = zstandard.ZstdCompressor(level=settings.getint('HTTPCACHE_ZSTD_LEVEL', 3))
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.db = None
+        self.fingerprinter = None
+        self.size = 0
+
+    def open_spider(self, spider):
+        self.fingerprinter = spider.crawler.request_fingerprinter
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key BLOB PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers BLOB NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at_idx ON responses (accessed_at)")
+        self.size = self.db.execute("SELECT coalesce(sum(size), 0) FROM responses").fetchone()[0]
+        logger.debug(f"Using SQLite HTTP cache storage in {self.path} ({self.size} bytes)", extra={'spider': spider})
+
+    def close_spider(self, spider):
+        self.db.close()
+        self.db = None
+
+    def request_key(self, request):
+        key = hashlib.blake2b(self.fingerprinter.fingerprint(request), digest_size=20)
+        if request.meta.get('playwright'):
+            spec = page_methods_spec(request.meta.get('playwright_page_methods'))
+            key.update(json.dumps(spec, sort_keys=True, default=repr).encode('utf-8'))
+        return key.digest()
+
+    def retrieve_response(self, spider, request):
+        key = self.request_key(request)
+        row = self.db.execute(
+            "SELECT url, status, headers, body, stored_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        url, status, headers, body, stored_at = row
+        now = time.time()
+        if 0 < self.expiration_secs < now - stored_at:
+            self.delete(key)
+            return None
+
+        self.db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        headers = decode_headers(json.loads(self.decompressor.decompress(headers)))
+        body = self.decompressor.decompress(body)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        key = self.request_key(request)
+        headers = self.compressor.compress(json.dumps(encode_headers(response.headers)).encode('utf-8'))
+        body = self.compressor.compress(response.body)
+        size = len(headers) + len(body)
+        now = time.time()
+
+        self.db.execute("BEGIN")
+        previous = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses (key, url, status, headers, body, size, stored_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, response.url, response.status, headers, body, size, now, now),
+        )
+        self.db.execute("COMMIT")
+        self.size += size - (previous[0] if previous else 0)
+
+        if self.max_bytes and self.size > self.max_bytes:
+            self.evict()
+
+    def delete(self, key):
+        row = self.db.execute("DELETE FROM responses WHERE key = ? RETURNING size", (key,)).fetchone()
+        if row is not None:
+            self.size -= row[0]
+
+    def evict(self):
+        # free a tenth of the budget at once, so not every store has to evict
+        target = self.max_bytes * 0.9
+        keys = []
+        freed = 0
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if self.size - freed <= target:
+                break
+            keys.append((key,))
+            freed += size
+
+        self.db.execute("BEGIN")
+        self.db.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self.db.execute("COMMIT")
+        self.size -= freed
+        logger.debug(f"Evicted {len(keys)} responses ({freed} bytes) from {self.path}")
@@ -12,6 +12,8 @@ class DockerImageItem(scrapy.Item):
     is_official_image = scrapy.Field()
     is_verified_publisher = scrapy.Field()
     last_update = scrapy.Field()
+    # ISO timestamp estimated from last_update when the item was scraped
+    last_updated_at = scrapy.Field()
     description = scrapy.Field()
     chips = scrapy.Field()
     downloads = scrapy.Field()
@@ -21,6 +23,7 @@ class DockerImageItem(scrapy.Item):
 
 
 class DockerBlogPostItem(scrapy.Item):
+    url = scrapy.Field()
     title = scrapy.Field()
     authors = scrapy.Field()
     post_tags = scrapy.Field()
@@ -41,16 +44,22 @@ class DockerBlogPostCodeItem(scrapy.Item):
 
 
 class DockerDocsComposeItem(scrapy.Item):
-    content = scrapy.Field()
+    # yielded after the sections and code of a page, marks the page as complete
+    url = scrapy.Field()
+    title = scrapy.Field()
+    section_count = scrapy.Field()
+    code_count = scrapy.Field()
 
 
 class DockerDocsComposeSectionItem(scrapy.Item):
     title = scrapy.Field()
     content = scrapy.Field()
     url = scrapy.Field()
+    position = scrapy.Field()
 
 
 class DockerDocsComposeCodeItem(scrapy.Item):
     language = scrapy.Field()
     code = scrapy.Field()
     url = scrapy.Field()
+    position = scrapy.Field()
@@ -0,0 +1,105 @@
+# Compact on-disk state of paused crawls, see JOBDIR.
+#
+# A crawl started with -s JOBDIR=<dir> keeps its pending requests and the
+# fingerprints of the requests it has seen in <dir>. It can be stopped (once with
+# Ctrl-C, or by scrapyd) and resumed with the same command.
+
+import pickle
+import zlib
+from pathlib import Path
+
+from queuelib import queue
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.squeues import _pickle_serialize, _scrapy_serialization_queue, _serializable_queue, _with_mkdir
+
+SEEN_FILE = 'requests.seen.bin'
+# the hex fingerprints written by Scrapy's RFPDupeFilter
+LEGACY_SEEN_FILE = 'requests.seen'
+
+# typical requests of the spiders, pickled they are the preset dictionary of the
+# compressor, so a record mostly refers to it instead of repeating keys and selectors
+REQUEST_SAMPLES = [
+    {'url': 'https://hub.docker.com/r/bitnami/python/tags', 'callback': 'parse_registry', 'errback': None,
+     'headers': {}, 'method': 'GET', 'body': b'', 'cookies': {},
+     'meta': {'playwright': True, 'playwright_page_methods': {
+         'wait_for_selector_repo_name': {'method': 'wait_for_selector',
+                                         'args': ['body[aria-describedby="global-progress"]'], 'kwargs': {}},
+         'wait_for_selector_tag_list': {'method': 'wait_for_selector',
+                                        'args': ['div[data-testid="repotagsTagList"]'], 'kwargs': {}}}},
+     'encoding': 'utf-8', 'priority': 0, 'dont_filter': False, 'flags': [], 'cb_kwargs': {'last_update': '2 days ago'}},
+    {'url': 'https://hub.docker.com/search?q=python&page=2', 'callback': 'parse', 'errback': None,
+     'headers': {}, 'method': 'GET', 'body': b'', 'cookies': {},
+     'meta': {'playwright': True, 'playwright_page_methods': {
+         'wait_for_search_results': {'method': 'wait_for_selector', 'args': ['div#searchResults'], 'kwargs': {}}},
+         'current_page': 2},
+     'encoding': 'utf-8', 'priority': 0, 'dont_filter': False, 'flags': [], 'cb_kwargs': {}},
+    {'url': 'https://hub.docker.com/v2/repositories/library/python/', 'callback': 'parse_api_repository',
+     'errback': 'api_errback', 'headers': {b'Accept': [b'application/json']}, 'method': 'GET', 'body': b'',
+     'cookies': {}, 'meta': {'dockerhub_image': 'python', 'depth': 1},
+     'encoding': 'utf-8', 'priority': 0, 'dont_filter': False, 'flags': [], 'cb_kwargs': {}},
+]
+# records start with the version of their dictionary; queued records must stay readable,
+# so add a new version instead of changing the samples
+DICTIONARY_VERSION = 1
+DICTIONARIES = {1: b''.join(pickle.dumps(sample, protocol=4) for sample in REQUEST_SAMPLES)}
+
+
+def compress_request(request_dict):
+    # fast level, the queues are written and read once
+    compressor = zlib.compressobj(1, zdict=DICTIONARIES[DICTIONARY_VERSION])
+    data = compressor.compress(_pickle_serialize(request_dict)) + compressor.flush()
+    return bytes((DICTIONARY_VERSION,)) + data
+
+
+def decompress_request(data):
+    decompressor = zlib.decompressobj(zdict=DICTIONARIES[data[0]])
+    return pickle.loads(decompressor.decompress(data[1:]) + decompressor.flush())
+
+
+# Scrapy's PickleLifoDiskQueue with compressed records
+ZlibPickleLifoDiskQueue = _scrapy_serialization_queue(
+    _serializable_queue(_with_mkdir(queue.LifoDiskQueue), compress_request, decompress_request)
+)
+
+
+def read_fingerprints(data):
+    # records are <length><fingerprint>, a record cut off by a crash is ignored
+    position = 0
+    while position < len(data):
+        end = position + 1 + data[position]
+        if end > len(data):
+            break
+        yield data[position + 1:end]
+        position = end
+
+
+class CompactDupeFilter(RFPDupeFilter):
+    """RFPDupeFilter that keeps the fingerprints as bytes instead of hex strings.
+
+    A fingerprint takes 21 bytes in JOBDIR/requests.seen.bin instead of 41, and
+    less memory in the set of seen fingerprints. The requests.seen file of a job
+    started with RFPDupeFilter is read when the job is resumed.
+    """
+
+    def __init__(self, path=None, debug=False, *, fingerprinter=None):
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        if path:
+            legacy = Path(path, LEGACY_SEEN_FILE)
+            if legacy.exists():
+                with legacy.open(encoding='utf-8') as f:
+                    self.fingerprints.update(bytes.fromhex(line.strip()) for line in f if line.strip())
+            self.file = Path(path, SEEN_FILE).open('a+b')
+            self.file.seek(0)
+            self.fingerprints.update(read_fingerprints(self.file.read()))
+
+    def request_seen(self, request):
+        fingerprint = self.request_fingerprint(request)
+        if fingerprint in self.fingerprints:
+            return True
+        self.fingerprints.add(fingerprint)
+        if self.file:
+            self.file.write(bytes((len(fingerprint),)) + fingerprint)
+        return False
+
+    def request_fingerprint(self, request):
+        return self.fingerprinter.fingerprint(request)
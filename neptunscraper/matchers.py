@@ -0,0 +1,175 @@
+# Matchers compiled once from configured patterns, shared by the middlewares and extensions.
+
+import re
+from urllib.parse import urlsplit
+
+
+def normalize_host(host):
+    return host.strip().lower().rstrip('.').lstrip('.') if host else ''
+
+
+class HostSuffixIndex:
+    """Matches a host against domains and all of their subdomains.
+
+    "doubleclick.net" matches "doubleclick.net" and "ad.g.doubleclick.net", but not
+    "notdoubleclick.net". A lookup walks the labels of the host, so its cost does not
+    depend on the number of domains.
+    """
+
+    def __init__(self, domains=()):
+        self.domains = {normalize_host(domain) for domain in domains if normalize_host(domain)}
+
+    def __len__(self):
+        return len(self.domains)
+
+    def match(self, host):
+        host = normalize_host(host)
+        while host:
+            if host in self.domains:
+                return host
+            _, _, host = host.partition('.')
+        return None
+
+
+class AhoCorasick:
+    """Finds every pattern contained in a text in one pass over the text.
+
+    Patterns map to values, `search(text)` returns the values of all patterns
+    found in the text, so its cost depends on the length of the text and not on
+    the number of patterns.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern, value in patterns:
+            if pattern:
+                self.add(pattern, value)
+        self.build()
+
+    def add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append(value)
+
+    def build(self):
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                # a state also matches everything its fallback state matches
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def search(self, text):
+        found = []
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                found.extend(self.output[state])
+        return found
+
+
+RULE_KINDS = ('substring', 'host', 'regex')
+RULE_TARGETS = ('url', 'referer')
+# named groups, backreferences and conditionals of a rule would break in an alternation with other rules
+STANDALONE_REGEX = re.compile(r'\(\?P[<=]|\(\?\(|\\[1-9]')
+
+
+class RuleSet:
+    """All rules of one target, compiled into one matcher per kind of rule."""
+
+    def __init__(self, rules):
+        self.substrings = AhoCorasick((rule['substring'], rule['name']) for rule in rules if 'substring' in rule)
+        self.hosts = {}
+        for rule in rules:
+            if 'host' in rule:
+                self.hosts.setdefault(normalize_host(rule['host']), []).append(rule['name'])
+        # one alternation per action, the group of the matching alternative tells the rule
+        self.regexes = []
+        for action in ('allow', 'deny'):
+            regex_rules = [rule for rule in rules if 'regex' in rule and rule['action'] == action]
+            for rule in regex_rules:
+                if STANDALONE_REGEX.search(rule['regex']):
+                    self.regexes.append((re.compile(rule['regex']), [(0, rule['name'])]))
+            regex_rules = [rule for rule in regex_rules if not STANDALONE_REGEX.search(rule['regex'])]
+            if regex_rules:
+                regex = re.compile('|'.join(f'({rule["regex"]})' for rule in regex_rules))
+                groups = []
+                group = 1
+                for rule in regex_rules:
+                    groups.append((group, rule['name']))
+                    # the groups of the rule itself follow its own
+                    group += 1 + re.compile(rule['regex']).groups
+                self.regexes.append((regex, groups))
+
+    def match(self, url):
+        names = set(self.substrings.search(url))
+        if self.hosts:
+            host = urlsplit(url).hostname
+            # every suffix of the host may be a rule of its own
+            while host:
+                names.update(self.hosts.get(host, ()))
+                _, _, host = host.partition('.')
+        for regex, groups in self.regexes:
+            match = regex.search(url)
+            if match:
+                names.add(next(name for group, name in groups if match.group(group) is not None))
+        return names
+
+
+class RequestRules:
+    """Allow/deny rules for the URL and the referer of requests.
+
+    A rule is a dict with an `action` ("allow" or "deny"), a `target` ("url" or
+    "referer"), one of `substring`, `host` (the host and its subdomains) or `regex`,
+    and an optional `name`. A request is denied when a deny rule matches and no
+    allow rule does.
+    """
+
+    def __init__(self, rules):
+        self.rules = []
+        for index, rule in enumerate(rules):
+            rule = dict(rule)
+            kinds = [kind for kind in RULE_KINDS if kind in rule]
+            if rule.get('action') not in ('allow', 'deny') or rule.get('target') not in RULE_TARGETS or len(kinds) != 1:
+                raise ValueError(f"Invalid request rule {rule!r}")
+            rule.setdefault('name', f"{rule['action']}-{rule['target']}-{index}")
+            self.rules.append(rule)
+
+        self.actions = {rule['name']: rule['action'] for rule in self.rules}
+        self.rule_sets = {
+            target: RuleSet([rule for rule in self.rules if rule['target'] == target])
+            for target in RULE_TARGETS
+            if any(rule['target'] == target for rule in self.rules)
+        }
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, url, referer=None):
+        names = set()
+        if 'url' in self.rule_sets:
+            names |= self.rule_sets['url'].match(url)
+        if referer and 'referer' in self.rule_sets:
+            names |= self.rule_sets['referer'].match(referer)
+        return names
+
+    def is_denied(self, names):
+        actions = {self.actions[name] for name in names}
+        return 'deny' in actions and 'allow' not in actions
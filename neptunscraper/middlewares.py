@@ -3,37 +3,67 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import asyncio
+import logging
+import random
+from collections import defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from scrapy import signals
-from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.downloadermiddlewares.retry import RetryMiddleware, get_retry_request
+from scrapy.utils.defer import deferred_from_coro
 from scrapy.utils.response import response_status_message
-from scrapy.exceptions import IgnoreRequest
+from scrapy.exceptions import IgnoreRequest, NotConfigured
 import time
+from neptunscraper import helpers
+from neptunscraper.matchers import RequestRules
+from neptunscraper.proxies import ProxyPool, proxy_evicted
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+logger = logging.getLogger(__name__)
 
-class RefererMiddleware:
-    def __init__(self, blocked_urls):
-        self.blocked_urls = blocked_urls
+
+class RequestRulesMiddleware:
+    """Drops requests denied by REQUEST_RULES, see matchers.RequestRules.
+
+    Every BLOCKED_REFERER_URLS entry is a deny rule for referers containing it.
+    Hits are counted per rule under request_rules/hits/<rule name>.
+    """
+
+    def __init__(self, rules, stats):
+        self.rules = rules
+        self.stats = stats
 
     @classmethod
     def from_crawler(cls, crawler):
-        # Initialize the middleware with the blocked URLs list
-        blocked_urls = crawler.settings.getlist('BLOCKED_REFERER_URLS', [])
-        return cls(blocked_urls)
+        rules = list(crawler.settings.getlist('REQUEST_RULES', []))
+        rules.extend(
+            dict(action='deny', target='referer', substring=url_pattern, name=f'blocked-referer-{index}')
+            for index, url_pattern in enumerate(crawler.settings.getlist('BLOCKED_REFERER_URLS', []))
+        )
+        if not rules:
+            raise NotConfigured
+        return cls(RequestRules(rules), crawler.stats)
 
     def process_request(self, request, spider):
-        # Check if the request has a referrer header
-        referrer = request.headers.get('Referer')
-        if referrer:
-            for url_pattern in self.blocked_urls:
-                if url_pattern in referrer.decode('utf-8'):
-                    # Cancel the request if the referrer matches a blocked URL pattern
-                    raise IgnoreRequest(f"Request blocked due to referrer from {referrer}")
-
+        referer = request.headers.get('Referer')
+        names = self.rules.match(request.url, referer.decode('utf-8', 'replace') if referer else None)
+        if not names:
+            return None
+
+        for name in names:
+            self.stats.inc_value(f'request_rules/hits/{name}')
+        if self.rules.is_denied(names):
+            self.stats.inc_value('request_rules/denied')
+            raise IgnoreRequest(f"Request denied by the rules {', '.join(sorted(names))}")
         return None
 
 
+# the former name of the middleware, which only knew BLOCKED_REFERER_URLS
+RefererMiddleware = RequestRulesMiddleware
+
+
 class NeptunscraperSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the spider middleware does not modify the
@@ -128,26 +158,426 @@ class NeptunscraperDownloaderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
-class TooManyRequestsRetryMiddleware(RetryMiddleware):
+class RateLimitRetryMiddleware(RetryMiddleware):
+    """Retries rate limited requests without blocking the reactor.
+
+    A 429 response (or a 503 with Retry-After) pauses its download slot for the time
+    given by Retry-After or the rate limit reset header, or for a jittered exponential
+    backoff without them. Up to RATELIMIT_MAX_PARKED_REQUESTS requests of a paused slot
+    wait in process_request outside of the active requests of the downloader, so
+    requests to other slots keep going.
+    Other responses are retried like by the RetryMiddleware.
+    """
 
     def __init__(self, crawler):
-        super(TooManyRequestsRetryMiddleware, self).__init__(crawler.settings)
+        super(RateLimitRetryMiddleware, self).__init__(crawler.settings)
         self.crawler = crawler
+        self.stats = crawler.stats
+        # RETRY_TIMES (max_retry_times) stays the limit of the other retries
+        self.ratelimit_max_retry_times = crawler.settings.getint('RATELIMIT_MAX_RETRIES', 10)
+        self.backoff_base = crawler.settings.getfloat('RATELIMIT_BACKOFF_BASE', 5.0)
+        self.max_delay = crawler.settings.getfloat('RATELIMIT_MAX_DELAY', 600.0)
+        self.max_parked = crawler.settings.getint('RATELIMIT_MAX_PARKED_REQUESTS', 8)
+        self.paused_until = {}
+        # requests per slot waiting outside of the active requests of the downloader
+        self.parked = defaultdict(int)
+        self.failures = defaultdict(int)
 
     @classmethod
     def from_crawler(cls, crawler):
         return cls(crawler)
 
+    def slot_key(self, request):
+        downloader = self.crawler.engine.downloader
+        # public since Scrapy 2.12
+        if hasattr(downloader, 'get_slot_key'):
+            return downloader.get_slot_key(request)
+        return downloader._get_slot_key(request, None)
+
+    async def process_request(self, request, spider):
+        key = self.slot_key(request)
+        remaining = self.paused_until.get(key, 0) - time.monotonic()
+        if remaining <= 0:
+            return None
+
+        # the downloader counts the request as active from here on, a waiting request
+        # would take up CONCURRENT_REQUESTS and hold up the requests to other slots
+        engine = self.crawler.engine
+        active = engine.downloader.active
+        parked = self.parked[key] < self.max_parked
+        self.stats.inc_value('ratelimit/waiting_requests')
+        if parked:
+            self.parked[key] += 1
+            active.discard(request)
+            # the engine only asks for the next request every few seconds when it is not woken up
+            slot = getattr(engine, 'slot', None) or getattr(engine, '_slot', None)
+            if slot is not None:
+                slot.nextcall.schedule()
+        # otherwise it stays active, so the engine stops taking requests from the scheduler
+        # (and the JOBDIR queue or the crawl frontier) once the slot has enough of them
+        try:
+            while remaining > 0:
+                await asyncio.sleep(remaining)
+                # the pause may have been extended in the meantime
+                remaining = self.paused_until.get(key, 0) - time.monotonic()
+        finally:
+            if parked:
+                self.parked[key] -= 1
+                # the downloader removes it again once it is downloaded
+                active.add(request)
+        return None
+
     def process_response(self, request, response, spider):
+        key = self.slot_key(request)
+        rate_limited = response.status == 429 or (response.status == 503 and b'Retry-After' in response.headers)
+        if not rate_limited:
+            self.failures.pop(key, None)
+            if response.headers.get(b'X-RateLimit-Remaining') == b'0':
+                # the next request would be rejected, wait for the reset right away
+                delay = self.reset_delay(response)
+                if delay:
+                    self.pause(key, delay, spider)
+            return super().process_response(request, response, spider)
+
+        self.stats.inc_value('ratelimit/responses')
+        self.failures[key] += 1
+        delay = self.retry_after(response) or self.reset_delay(response) or self.backoff(self.failures[key])
+        self.pause(key, delay, spider)
         if request.meta.get('dont_retry', False):
             return response
-        elif response.status == 429:
-            self.crawler.engine.pause()
-            time.sleep(60)  # If the rate limit is renewed in a minute, put 60 seconds, and so on.
-            self.crawler.engine.unpause()
-            reason = response_status_message(response.status)
-            return self._retry(request, reason, spider) or response
-        elif response.status in self.retry_http_codes:
-            reason = response_status_message(response.status)
-            return self._retry(request, reason, spider) or response
-        return response
\ No newline at end of file
+
+        retry_request = get_retry_request(
+            request,
+            spider=spider,
+            reason=response_status_message(response.status),
+            max_retry_times=request.meta.get('max_retry_times', self.ratelimit_max_retry_times),
+            stats_base_key='ratelimit/retry',
+        )
+        return retry_request or response
+
+    def pause(self, key, delay, spider):
+        delay = min(delay, self.max_delay)
+        now = time.monotonic()
+        paused_until = self.paused_until.get(key, 0)
+        resume_at = now + delay
+        if resume_at <= paused_until:
+            return
+        # only count the time that was not already covered by a running pause
+        self.stats.inc_value('ratelimit/throttled_seconds', round(resume_at - max(paused_until, now), 3))
+        self.stats.inc_value('ratelimit/pauses')
+        self.paused_until[key] = resume_at
+        spider.logger.info(f"Rate limited by {key}, pausing its requests for {delay:.1f}s")
+
+    def backoff(self, failures):
+        delay = min(self.backoff_base * 2 ** (failures - 1), self.max_delay)
+        # "equal jitter", so slots rate limited at the same time do not retry at the same time
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def retry_after(response):
+        value = response.headers.get(b'Retry-After')
+        if not value:
+            return None
+        value = value.decode('latin1').strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+    @staticmethod
+    def reset_delay(response):
+        value = response.headers.get(b'X-RateLimit-Reset') or response.headers.get(b'RateLimit-Reset')
+        if not value:
+            return None
+        try:
+            reset = float(value.decode('latin1').strip())
+        except ValueError:
+            return None
+        # either an epoch timestamp or the number of seconds until the reset
+        if reset > 1_000_000_000:
+            reset -= time.time()
+        return max(reset, 0.0)
+
+
+class PageMethodSpecMiddleware:
+    """Builds the PageMethods of a Playwright request from their specs (helpers.page_method).
+
+    The built PageMethods only live while the request is downloaded, they hold
+    live page objects once executed. The specs are back in the meta before the
+    retry and cache middlewares see the response, so a retried request can still
+    be pickled.
+    """
+
+    def process_request(self, request, spider):
+        specs = request.meta.get('playwright_page_methods')
+        if not request.meta.get('playwright') or not specs or 'playwright_page_method_specs' in request.meta:
+            return None
+        request.meta['playwright_page_method_specs'] = specs
+        request.meta['playwright_page_methods'] = helpers.build_page_methods(specs)
+        return None
+
+    def process_response(self, request, response, spider):
+        self.restore(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.restore(request)
+        return None
+
+    @staticmethod
+    def restore(request):
+        if 'playwright_page_method_specs' in request.meta:
+            request.meta['playwright_page_methods'] = request.meta.pop('playwright_page_method_specs')
+
+
+class PlaywrightPagePoolMiddleware:
+    """Keeps rendered pages open and hands them to the next request of the same context.
+
+    A page is reset to about:blank before it is reused and closed after `max_uses`
+    requests or when its request failed. Requests that set `playwright_include_page`
+    themselves keep managing their page, `playwright_page_pool=False` opts out.
+
+    An idle page still counts against PLAYWRIGHT_MAX_PAGES_PER_CONTEXT, so at most one
+    page less is kept per context, and a request that opts out closes an idle page of
+    its context before its own page is created. The pages of an evicted proxy are closed
+    with its context.
+    """
+
+    def __init__(self, stats, max_idle=4, max_uses=50):
+        self.stats = stats
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.idle = defaultdict(list)
+        self.uses = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PLAYWRIGHT_PAGE_POOL_ENABLED', True):
+            raise NotConfigured
+        # the default of scrapy-playwright, a page less leaves room for a page that is not pooled
+        max_pages = (crawler.settings.getint('PLAYWRIGHT_MAX_PAGES_PER_CONTEXT')
+                     or crawler.settings.getint('CONCURRENT_REQUESTS'))
+        max_idle = min(crawler.settings.getint('PLAYWRIGHT_PAGE_POOL_SIZE', 4), max_pages - 1)
+        if max_idle < 1:
+            raise NotConfigured(f"PLAYWRIGHT_MAX_PAGES_PER_CONTEXT is {max_pages}, there is no room for idle pages")
+        middleware = cls(
+            crawler.stats,
+            max_idle=max_idle,
+            max_uses=crawler.settings.getint('PLAYWRIGHT_PAGE_POOL_MAX_USES', 50),
+        )
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.proxy_evicted, signal=proxy_evicted)
+        return middleware
+
+    async def process_request(self, request, spider):
+        if not request.meta.get('playwright'):
+            return None
+
+        key = request.meta.get('playwright_context', 'default')
+        idle = self.idle[key]
+        if request.meta.get('playwright_include_page') or request.meta.get('playwright_page_pool') is False:
+            # its new page would otherwise wait for an idle page to free up a page of the context
+            if idle and 'playwright_page' not in request.meta:
+                self.stats.inc_value('playwright_page_pool/recycled/opt_out')
+                await self.close_page(idle.pop())
+            return None
+
+        while idle:
+            page = idle.pop()
+            if not page.is_closed():
+                request.meta['playwright_page'] = page
+                self.stats.inc_value('playwright_page_pool/hits')
+                break
+            self.uses.pop(page, None)
+        else:
+            self.stats.inc_value('playwright_page_pool/misses')
+
+        request.meta['playwright_include_page'] = True
+        request.meta['playwright_page_pool_key'] = key
+        return None
+
+    async def process_response(self, request, response, spider):
+        page, key = self.take_page(request)
+        if page is not None:
+            await self.release(page, key)
+        return response
+
+    async def process_exception(self, request, exception, spider):
+        page, key = self.take_page(request)
+        if page is not None:
+            self.stats.inc_value('playwright_page_pool/recycled/error')
+            await self.close_page(page)
+        return None
+
+    def take_page(self, request):
+        key = request.meta.pop('playwright_page_pool_key', None)
+        if key is None:
+            return None, None
+        # the meta goes back to its original state, e.g. for a retry of the request
+        request.meta.pop('playwright_include_page', None)
+        return request.meta.pop('playwright_page', None), key
+
+    async def release(self, page, key):
+        uses = self.uses.get(page, 0) + 1
+        if page.is_closed():
+            self.uses.pop(page, None)
+            return
+        if uses >= self.max_uses:
+            self.stats.inc_value('playwright_page_pool/recycled/max_uses')
+            await self.close_page(page)
+            return
+        if len(self.idle[key]) >= self.max_idle:
+            self.stats.inc_value('playwright_page_pool/recycled/overflow')
+            await self.close_page(page)
+            return
+
+        try:
+            await page.goto('about:blank')
+        except Exception:
+            self.stats.inc_value('playwright_page_pool/recycled/error')
+            await self.close_page(page)
+            return
+
+        self.uses[page] = uses
+        self.stats.inc_value('playwright_page_pool/reused')
+        self.idle[key].append(page)
+
+    async def close_page(self, page):
+        self.uses.pop(page, None)
+        if not page.is_closed():
+            await page.close()
+
+    def spider_closed(self, spider):
+        hits = self.stats.get_value('playwright_page_pool/hits', 0)
+        misses = self.stats.get_value('playwright_page_pool/misses', 0)
+        if hits + misses:
+            self.stats.set_value('playwright_page_pool/hit_rate', round(hits / (hits + misses), 3))
+        return deferred_from_coro(self.close_all())
+
+    def proxy_evicted(self, proxy, reason):
+        pages = self.idle.pop(proxy.context, [])
+        if pages:
+            asyncio.ensure_future(self.close_pages(pages))
+
+    async def close_pages(self, pages):
+        for page in pages:
+            await self.close_page(page)
+
+    async def close_all(self):
+        for pages in self.idle.values():
+            await self.close_pages(pages)
+        self.idle.clear()
+
+
+class ProxyPoolMiddleware:
+    """Sends requests through the healthy proxies of the ProxyPool.
+
+    Playwright requests get a browser context per proxy, other requests the `proxy`
+    meta key. At most `max_contexts` proxy contexts are live, further Playwright requests
+    share their proxies, and the context of an evicted proxy is closed. A proxy answering
+    with one of PROXY_POOL_BAN_CODES is evicted, and the retry of the request picks
+    another one. Without healthy proxies requests go out directly.
+    """
+
+    def __init__(self, crawler, pool, ban_codes=(403, 429), max_contexts=8):
+        self.crawler = crawler
+        self.pool = pool
+        self.stats = crawler.stats
+        self.ban_codes = set(ban_codes)
+        self.max_contexts = max_contexts
+        # Playwright context name -> proxy
+        self.contexts = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(
+            crawler,
+            ProxyPool.from_crawler(crawler),
+            ban_codes=[int(code) for code in crawler.settings.getlist('PROXY_POOL_BAN_CODES', [403, 429])],
+            max_contexts=crawler.settings.getint('PROXY_POOL_MAX_CONTEXTS', 8),
+        )
+        crawler.signals.connect(middleware.proxy_evicted, signal=proxy_evicted)
+        return middleware
+
+    async def process_request(self, request, spider):
+        if request.meta.get('dont_proxy'):
+            return None
+        await self.pool.wait_until_ready()
+
+        proxy = self.pool.get(request.meta.get('proxy_pool_proxy'))
+        if proxy is None or proxy.evicted:
+            proxy = self.pool.choose()
+        if proxy is None:
+            self.stats.inc_value('proxy_pool/direct')
+            self.clear(request)
+            return None
+
+        if request.meta.get('playwright'):
+            if proxy.context not in self.contexts and len(self.contexts) >= self.max_contexts:
+                proxy = self.pool.choose(self.contexts.values()) or proxy
+            self.contexts[proxy.context] = proxy
+            request.meta['playwright_context'] = proxy.context
+            # keeps the options of the spider, e.g. ignore_https_errors
+            request.meta['playwright_context_kwargs'] = {
+                **request.meta.get('playwright_context_kwargs', {}),
+                'proxy': {'server': proxy.url},
+            }
+        else:
+            request.meta['proxy'] = proxy.url
+        request.meta['proxy_pool_proxy'] = proxy.url
+        self.stats.inc_value('proxy_pool/requests')
+        return None
+
+    def process_response(self, request, response, spider):
+        proxy = self.pool.get(request.meta.get('proxy_pool_proxy'))
+        if proxy is not None:
+            self.close_evicted_context(request, proxy)
+            if response.status in self.ban_codes:
+                self.pool.evict(proxy, f'status_{response.status}')
+            else:
+                self.pool.record(proxy, True, request.meta.get('download_latency'))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        proxy = self.pool.get(request.meta.get('proxy_pool_proxy'))
+        if proxy is not None:
+            self.close_evicted_context(request, proxy)
+            self.stats.inc_value('proxy_pool/errors')
+            self.pool.record(proxy, False)
+        return None
+
+    def proxy_evicted(self, proxy, reason):
+        if self.contexts.pop(proxy.context, None) is not None:
+            asyncio.ensure_future(self.close_context(proxy.context))
+
+    def close_evicted_context(self, request, proxy):
+        # requests queued before the eviction opened the context of the proxy again
+        if proxy.evicted and request.meta.get('playwright'):
+            asyncio.ensure_future(self.close_context(proxy.context))
+
+    async def close_context(self, name):
+        handler = self.crawler.engine.downloader.handlers._get_handler('https')
+        wrapper = getattr(handler, 'context_wrappers', {}).get(name)
+        if wrapper is None:
+            return
+        try:
+            await wrapper.context.close()
+        except Exception as e:
+            logger.debug(f"Could not close the browser context {name}: {e}")
+            return
+        self.stats.inc_value('proxy_pool/contexts_closed')
+
+    @staticmethod
+    def clear(request):
+        request.meta.pop('proxy_pool_proxy', None)
+        request.meta.pop('proxy', None)
+        if str(request.meta.get('playwright_context', '')).startswith('proxy-'):
+            del request.meta['playwright_context']
+            kwargs = dict(request.meta.pop('playwright_context_kwargs', {}))
+            kwargs.pop('proxy', None)
+            if kwargs:
+                request.meta['playwright_context_kwargs'] = kwargs
+
@@ -1,123 +1,612 @@
 from itemadapter import ItemAdapter
 import os
+import asyncio
 import json
+import heapq
+import shutil
+import tempfile
+import contextlib
+import operator
+import multiprocessing
 from collections import defaultdict
-from neptunscraper import items
+from concurrent.futures import ProcessPoolExecutor
+from neptunscraper import conversion, helpers, items
 import psycopg
+from scrapy.utils.defer import deferred_from_coro
+from twisted.internet import task
 
-from neptunscraper.items import DockerBlogPostItem, DockerImageItem
+from neptunscraper.items import (
+    DockerBlogPostItem,
+    DockerDocsComposeCodeItem,
+    DockerDocsComposeItem,
+    DockerDocsComposeSectionItem,
+    DockerImageItem,
+)
+from neptunscraper.postgres import PostgresPool
+from neptunscraper.spool import Spool, SpoolDrainer
 
 
 class DockerPipeline:
+    """Writes items to output.json ordered by downloads without holding the crawl in memory.
+
+    Items are collected into sorted JSONL segments of at most `segment_size` items,
+    which are merged into the final file when the spider closes.
+    """
+
+    def __init__(self, segment_size=1000, merge_fan_in=64):
+        self.segment_size = segment_size
+        self.merge_fan_in = merge_fan_in
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            segment_size=crawler.settings.getint('DOCKER_PIPELINE_SEGMENT_SIZE', 1000),
+            merge_fan_in=crawler.settings.getint('DOCKER_PIPELINE_MERGE_FAN_IN', 64),
+        )
 
     def open_spider(self, spider):
-        self.items = []
+        self.output_dir = spider.output_dir if hasattr(spider, 'output_dir') else 'output'
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.segment_dir = tempfile.mkdtemp(prefix='segments-', dir=self.output_dir)
+        self.segments = []
+        self.segment_count = 0
+        self.chunk = []
 
     def close_spider(self, spider):
-        sorted_items = sorted(self.items, key=lambda x: self.sort_downloads(x['downloads']))
+        if self.chunk:
+            self.write_segment(sorted(self.chunk, key=self.sort_key))
+            self.chunk = []
 
-        output_dir = spider.output_dir if hasattr(spider, 'output_dir') else 'output'
-        os.makedirs(output_dir, exist_ok=True)
-        output_file = os.path.join(output_dir, 'output.json')
+        # merge in passes, so the number of open files stays bounded
+        while len(self.segments) > self.merge_fan_in:
+            groups = [self.segments[i:i + self.merge_fan_in] for i in range(0, len(self.segments), self.merge_fan_in)]
+            self.segments = []
+            for group in groups:
+                self.write_segment(self.merge_segments(group))
+                for path in group:
+                    os.remove(path)
 
+        output_file = os.path.join(self.output_dir, 'output.json')
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(sorted_items, f, ensure_ascii=False, indent=4)
+            f.write('[')
+            for index, item in enumerate(self.merge_segments(self.segments)):
+                f.write(',\n' if index else '\n')
+                f.write(json.dumps(item, ensure_ascii=False))
+            f.write('\n]\n')
+
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
 
     def process_item(self, item, spider):
-        self.items.append(ItemAdapter(item).asdict())
+        self.chunk.append(ItemAdapter(item).asdict())
+        if len(self.chunk) >= self.segment_size:
+            self.write_segment(sorted(self.chunk, key=self.sort_key))
+            self.chunk = []
         return item
 
-    def sort_downloads(self, downloads):
-        if downloads.endswith('+'):
-            return int(downloads[:-1])
-        else:
-            return float(downloads[:-1])
+    def write_segment(self, items):
+        path = os.path.join(self.segment_dir, f'{self.segment_count:06d}.jsonl')
+        self.segment_count += 1
+        with open(path, 'w', encoding='utf-8') as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False))
+                f.write('\n')
+        self.segments.append(path)
 
+    def merge_segments(self, paths):
+        with contextlib.ExitStack() as stack:
+            streams = [map(json.loads, stack.enter_context(open(path, encoding='utf-8'))) for path in paths]
+            yield from heapq.merge(*streams, key=self.sort_key)
 
-class BasePostgresPipeline:
-    def __init__(self):
-        self.connection = psycopg.connect(
-        dbname="neptun_data",
-        user="root",
-        password="secret",
-        host="localhost",
-        port="5432"
-        )
-        self.cursor = self.connection.cursor()
+    @staticmethod
+    def sort_key(item):
+        downloads = helpers.parse_count(item.get('downloads'))
+        # images without a download count go last
+        return downloads is None, downloads or 0
 
 
-class SaveRegistryToPostgresPipeline(BasePostgresPipeline):
-    def __init__(self):
-        super().__init__()
+class HtmlToTextPipeline:
+    """Converts the HTML of blog post code blocks and docs sections to text in worker processes.
+
+    Code blocks become plain text, docs sections markdown. At most `max_pending`
+    conversions are submitted at once, further items wait in the pipeline. The
+    reactor keeps running while an item is converted.
+    """
 
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS docker_images (
-                name TEXT PRIMARY KEY,
-                details JSONB
-            );
-        """)
+    def __init__(self, stats, workers=0, max_pending=0):
+        self.stats = stats
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.executor = None
+        self.pending = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler.stats,
+            workers=crawler.settings.getint('HTML_TO_TEXT_WORKERS', 0),
+            max_pending=crawler.settings.getint('HTML_TO_TEXT_MAX_PENDING', 0),
+        )
+
+    def open_spider(self, spider):
+        # spawned, a forked worker would inherit the event loop and the browser connection
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self.pending = asyncio.Semaphore(self.max_pending)
 
     def close_spider(self, spider):
-        if self.connection:
-            self.connection.commit()
-            self.cursor.close()
-            self.connection.close()
+        return deferred_from_coro(asyncio.to_thread(self.executor.shutdown))
 
-    def process_item(self, item, spider):
-        if isinstance(item, DockerImageItem):
-            item_data = dict(item)
-            name = item_data.pop('name')
-            details = json.dumps(item_data)  # Convert dict to JSON string
+    async def process_item(self, item, spider):
+        if isinstance(item, DockerBlogPostItem):
+            code = [code_item for section in item.get('sections') or [] for code_item in section.get('code') or []]
+            texts = await self.convert('code', [code_item.get('content') for code_item in code], spider)
+            for code_item, text in zip(code, texts):
+                code_item['content'] = text
+        elif isinstance(item, DockerDocsComposeSectionItem):
+            item['content'] = (await self.convert('markdown', [item.get('content')], spider))[0]
+        elif isinstance(item, DockerDocsComposeCodeItem):
+            # the text of the pre, cheap enough to normalize here
+            item['code'] = conversion.normalize_code(item.get('code') or '')
+        return item
 
+    async def convert(self, kind, values, spider):
+        if not any(values):
+            return values
+        async with self.pending:
             try:
-                self.cursor.execute("""
-                    INSERT INTO docker_images (name, details)
-                    VALUES (%s, %s)
-                    ON CONFLICT (name) 
-                    DO UPDATE SET details = EXCLUDED.details;
-                """, (name, details))
+                values = await asyncio.wrap_future(self.executor.submit(conversion.convert, kind, values))
             except Exception as e:
-                spider.logger.error(f"Error inserting item into PostgreSQL: {e}")
+                # stored as HTML, converted again on the next crawl
+                self.stats.inc_value(f'html_to_text/failed/{kind}')
+                spider.logger.warning(f"Could not convert {kind} HTML to text: {e!r}")
+                return values
+        self.stats.inc_value(f'html_to_text/converted/{kind}', len(values))
+        return values
+
+
+class BasePostgresPipeline:
+    """Spools matching items to disk and writes them to PostgreSQL in batches.
+
+    Subclasses define the handled `item_class`, the spool record `kind`, the key of
+    an item and `write_batch`, which writes one spool segment inside a transaction.
+    """
+    item_class = None
+    kind = None
+    # table and key column whose stored content hashes are used to skip unchanged items
+    hash_table = None
+    hash_key = None
+    # fields that change between crawls without the content changing, left out of the hash
+    unhashed_fields = ()
+    # spool record kind of the keys of unchanged items, written by `write_checked`
+    checked_kind = None
+
+    def __init__(self, pool, stats, spool_dir='spool', batch_size=500, flush_interval=30.0,
+                 max_pending_segments=20, spool_fsync=False):
+        self.pool = pool
+        self.stats = stats
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending_segments = max_pending_segments
+        self.spool_fsync = spool_fsync
+        self.known_hashes = {}
+        self.spool = None
+        self.drainer = None
+        self.flush_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            PostgresPool.from_crawler(crawler),
+            crawler.stats,
+            spool_dir=settings.get('SPOOL_DIR', 'spool'),
+            batch_size=settings.getint('POSTGRES_BATCH_SIZE', 500),
+            flush_interval=settings.getfloat('POSTGRES_FLUSH_INTERVAL', 30.0),
+            max_pending_segments=settings.getint('SPOOL_MAX_PENDING_SEGMENTS', 20),
+            spool_fsync=settings.getbool('SPOOL_FSYNC', False),
+        )
+
+    def open_spider(self, spider):
+        return deferred_from_coro(self._open_spider(spider))
+
+    def close_spider(self, spider):
+        return deferred_from_coro(self._close_spider(spider))
+
+    async def _open_spider(self, spider):
+        await self.pool.open()
+        if self.hash_table:
+            await self.load_known_hashes(spider)
+
+        self.spool = Spool(os.path.join(self.spool_dir, spider.name, self.kind), fsync=self.spool_fsync)
+        self.drainer = SpoolDrainer(
+            self.spool,
+            self.write_records,
+            self.stats,
+            f'postgres/{self.hash_table}',
+            max_pending=self.max_pending_segments,
+            transient_errors=(psycopg.OperationalError,),
+        )
+        self.drainer.start()
+        if self.flush_interval > 0:
+            self.flush_task = task.LoopingCall(lambda: deferred_from_coro(self.flush(force=False)))
+            self.flush_task.start(self.flush_interval / 2, now=False)
+
+    async def _close_spider(self, spider):
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        await self.flush()
+        await self.drainer.stop()
+        self.spool.close()
+
+    async def process_item(self, item, spider):
+        if not isinstance(item, self.item_class):
             return item
 
+        await self.store(ItemAdapter(item).asdict(), spider)
+        return item
+
+    async def store(self, item_data, spider):
+        key = self.item_key(item_data)
+        if not key:
+            spider.logger.warning(f"Skipping {self.kind} without a key: {item_data}")
+            return
+
+        digest = self.content_hash(item_data)
+        if self.classify_change(key, digest) == 'unchanged':
+            if self.checked_kind is None:
+                return
+            # only the time of the check is written
+            self.spool.append({'kind': self.checked_kind, 'item': {self.hash_key: key}})
+        else:
+            # spooled records survive a crash or an unavailable database
+            self.spool.append({'kind': self.kind, 'item': item_data})
+            self.known_hashes[key] = digest
+        if self.spool.active_records >= self.batch_size:
+            await self.flush()
+        await self.drainer.wait_for_capacity()
+
+    async def flush(self, force=True):
+        if force or self.spool.active_age() >= self.flush_interval:
+            path = self.spool.seal()
+            if path:
+                await self.drainer.notify(path)
+
+    async def write_records(self, records):
+        items = [record['item'] for record in records if record['kind'] == self.kind]
+        checked = [record['item'] for record in records if record['kind'] == self.checked_kind]
+        async with self.pool.connection() as conn:
+            if items:
+                await self.write_batch(conn, items)
+            if checked:
+                await self.write_checked(conn, checked)
+
+    @classmethod
+    def item_key(cls, item_data):
+        raise NotImplementedError
+
+    @classmethod
+    async def write_batch(cls, conn, items):
+        raise NotImplementedError
+
+    @classmethod
+    async def write_checked(cls, conn, items):
+        raise NotImplementedError
+
+    async def load_known_hashes(self, spider):
+        async with self.pool.connection() as conn:
+            # server-side cursor, so large tables are streamed instead of fetched at once
+            async with conn.cursor(name=f'{self.hash_table}_hashes') as cursor:
+                await cursor.execute(
+                    f"SELECT {self.hash_key}, content_hash FROM {self.hash_table} WHERE content_hash IS NOT NULL"
+                )
+                async for key, digest in cursor:
+                    self.known_hashes[key] = bytes(digest)
+        spider.logger.info(f"Loaded {len(self.known_hashes)} content hashes from {self.hash_table}")
+
+    @classmethod
+    def content_hash(cls, item_data):
+        return helpers.content_hash(item_data, exclude=cls.unhashed_fields)
+
+    def classify_change(self, key, digest):
+        known = self.known_hashes.get(key)
+        if known is None:
+            change = 'new'
+        elif known == digest:
+            change = 'unchanged'
+        else:
+            change = 'updated'
+        self.stats.inc_value(f'postgres/{self.hash_table}/items_{change}')
+        return change
+
+
+class SaveRegistryToPostgresPipeline(BasePostgresPipeline):
+    item_class = DockerImageItem
+    kind = 'docker_image'
+    hash_table = 'docker_images'
+    hash_key = 'name'
+    # the relative "3 days ago" of the browser, last_updated_at holds the update time
+    unhashed_fields = ('last_update',)
+    checked_kind = 'docker_image_checked'
+    columns = (
+        'name', 'uploader', 'is_official_image', 'is_verified_publisher', 'last_update', 'last_updated_at',
+        'description', 'chips', 'downloads', 'stars', 'pulls_last_week', 'content_hash',
+    )
+    column_types = (
+        'text', 'text', 'bool', 'bool', 'text', 'timestamptz', 'text', 'text[]', 'int8', 'int8', 'int8', 'bytea',
+    )
+
+    @classmethod
+    def item_key(cls, item_data):
+        return item_data.get('name')
+
+    @classmethod
+    async def write_batch(cls, conn, items):
+        # keyed by name, so a later item of the batch replaces an earlier one
+        batch = {item_data['name']: item_data for item_data in items}
+
+        async with conn.cursor() as cursor:
+            # the staging tables live for the session and are emptied by every commit
+            await cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS docker_images_staging
+                    (LIKE docker_images INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+                CREATE TEMP TABLE IF NOT EXISTS docker_image_tags_staging
+                    (LIKE docker_image_tags) ON COMMIT DELETE ROWS;
+            """)
+            async with cursor.copy(f"COPY docker_images_staging ({', '.join(cls.columns)}) FROM STDIN") as copy:
+                copy.set_types(cls.column_types)
+                for item_data in batch.values():
+                    await copy.write_row(cls.image_row(item_data))
+            async with cursor.copy(
+                "COPY docker_image_tags_staging (image_name, version, type_name) FROM STDIN"
+            ) as copy:
+                for item_data in batch.values():
+                    for tag_row in cls.tag_rows(item_data):
+                        await copy.write_row(tag_row)
+
+            updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in cls.columns[1:])
+            await cursor.execute(f"""
+                INSERT INTO docker_images ({', '.join(cls.columns)}, updated_at)
+                SELECT {', '.join(cls.columns)}, now() FROM docker_images_staging
+                ON CONFLICT (name)
+                DO UPDATE SET {updates}, updated_at = EXCLUDED.updated_at
+                WHERE docker_images.content_hash IS DISTINCT FROM EXCLUDED.content_hash;
+            """, prepare=True)
+            await cursor.execute("""
+                DELETE FROM docker_image_tags tags
+                USING docker_images_staging staging
+                WHERE tags.image_name = staging.name;
+            """, prepare=True)
+            await cursor.execute("""
+                INSERT INTO docker_image_tags (image_name, version, type_name)
+                SELECT DISTINCT image_name, version, type_name FROM docker_image_tags_staging;
+            """, prepare=True)
+        await cls.write_checked(conn, batch.values())
+
+    @classmethod
+    async def write_checked(cls, conn, items):
+        # delta crawls refetch images by the time they were last checked, not last changed
+        await conn.execute(
+            "UPDATE docker_images SET checked_at = now() WHERE name = ANY(%s)",
+            (list({item_data['name'] for item_data in items}),),
+            prepare=True,
+        )
+
+    @classmethod
+    def normalized(cls, item_data):
+        # the column values and the tags, "1B+" of one source and 1000000000 of another are the same count
+        return {
+            'name': item_data['name'],
+            'uploader': item_data.get('uploader'),
+            'is_official_image': item_data.get('is_official_image'),
+            'is_verified_publisher': item_data.get('is_verified_publisher'),
+            'last_update': item_data.get('last_update'),
+            'last_updated_at': helpers.parse_timestamp(item_data.get('last_updated_at')),
+            'description': item_data.get('description'),
+            'chips': list(item_data.get('chips') or []),
+            'downloads': helpers.parse_count(item_data.get('downloads')),
+            'stars': helpers.parse_count(item_data.get('stars')),
+            'pulls_last_week': helpers.parse_count(item_data.get('pulls_last_week')),
+            'tags': item_data.get('tags') or {},
+        }
+
+    @classmethod
+    def content_hash(cls, item_data):
+        return helpers.content_hash(cls.normalized(item_data), exclude=cls.unhashed_fields)
+
+    @classmethod
+    def image_row(cls, item_data):
+        row = cls.normalized(item_data)
+        return tuple(row[column] for column in cls.columns[:-1]) + (cls.content_hash(item_data),)
+
+    @staticmethod
+    def tag_rows(item_data):
+        return [
+            (item_data['name'], version, type_name)
+            for version, type_names in (item_data.get('tags') or {}).items()
+            for type_name in type_names
+        ]
+
 
 class SaveBlogPostToPostgresPipeline(BasePostgresPipeline):
-    def __init__(self):
-        super().__init__()
+    item_class = DockerBlogPostItem
+    kind = 'docker_blog_post'
+    hash_table = 'docker_blog_posts'
+    hash_key = 'id'
 
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS docker_blog_posts (
-                title TEXT PRIMARY KEY,
-                details JSONB
-            );
-        """)
+    @classmethod
+    def item_key(cls, item_data):
+        url = item_data.get('url') or item_data.get('title')
+        return helpers.stable_id(url) if url else None
 
-    def close_spider(self, spider):
-        if self.connection:
-            self.connection.commit()
-            self.cursor.close()
-            self.connection.close()
+    @classmethod
+    async def write_batch(cls, conn, items):
+        for item_data in items:
+            # one transaction (a savepoint within the batch) per post
+            async with conn.transaction():
+                await cls.write_post(conn, item_data)
 
-    def process_item(self, item, spider):
-        if isinstance(item, DockerBlogPostItem):
-            item_data = dict(item)
-            title = item_data.pop('title')
-            details = json.dumps(item_data)
-            try:
-                self.cursor.execute("""
-                    INSERT INTO docker_blog_posts(title, details)
-                    VALUES (%s, %s)
-                    ON CONFLICT (id) 
-                    DO UPDATE SET details = EXCLUDED.details;
-                """, (title, details))
-            except Exception as e:
-                spider.logger.error(f"Error inserting item into PostgreSQL: {e}")
+    @classmethod
+    async def write_post(cls, conn, item_data):
+        post_id = cls.item_key(item_data)
+        sections = item_data.get('sections') or []
+        code = [
+            (section_position, position, code_item.get('content'))
+            for section_position, section in enumerate(sections)
+            for position, code_item in enumerate(section.get('code') or [])
+        ]
+
+        await conn.execute("""
+            INSERT INTO docker_blog_posts
+                (id, url, title, content, authors, categories, post_tags, posted_on, content_hash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (id)
+            DO UPDATE SET url = EXCLUDED.url, title = EXCLUDED.title, content = EXCLUDED.content,
+                authors = EXCLUDED.authors, categories = EXCLUDED.categories,
+                post_tags = EXCLUDED.post_tags, posted_on = EXCLUDED.posted_on,
+                content_hash = EXCLUDED.content_hash, updated_at = now();
+        """, (
+            post_id, item_data.get('url'), item_data.get('title'), item_data.get('content'),
+            list(item_data.get('authors') or []), list(item_data.get('categories') or []),
+            list(item_data.get('post_tags') or []), item_data.get('posted_on'),
+            helpers.content_hash(item_data),
+        ), prepare=True)
+        # replaces the whole tree, the code blocks go with their sections
+        await conn.execute(
+            "DELETE FROM docker_blog_post_sections WHERE post_id = %s;", (post_id,), prepare=True
+        )
+        await conn.execute("""
+            INSERT INTO docker_blog_post_sections (post_id, position, title, content)
+            SELECT %s, * FROM unnest(%s::INTEGER[], %s::TEXT[], %s::TEXT[]);
+        """, (
+            post_id,
+            list(range(len(sections))),
+            [section.get('title') for section in sections],
+            [section.get('content') for section in sections],
+        ), prepare=True)
+        await conn.execute("""
+            INSERT INTO docker_blog_post_code (post_id, section_position, position, content)
+            SELECT %s, * FROM unnest(%s::INTEGER[], %s::INTEGER[], %s::TEXT[]);
+        """, (
+            post_id,
+            [row[0] for row in code],
+            [row[1] for row in code],
+            [row[2] for row in code],
+        ), prepare=True)
+        # rows migrated from the title-keyed table are superseded by the crawled post
+        if item_data.get('url') and item_data.get('title'):
+            await conn.execute(
+                "DELETE FROM docker_blog_posts WHERE url IS NULL AND title = %s;",
+                (item_data['title'],), prepare=True,
+            )
+
+
+class SaveDocsComposeToPostgresPipeline(BasePostgresPipeline):
+    """Groups the section and code items of a docs page and stores the page as a whole.
+
+    A page is complete once its DockerDocsComposeItem and the number of sections
+    and code blocks it announces have arrived, in any order.
+    """
+    kind = 'docker_docs_page'
+    hash_table = 'docker_docs_pages'
+    hash_key = 'url'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pages = defaultdict(lambda: {'page': None, 'sections': [], 'code': []})
+
+    async def _close_spider(self, spider):
+        for url in list(self.pages):
+            spider.logger.warning(f"Storing incomplete docs page {url}")
+            await self.store_page(url, spider)
+        await super()._close_spider(spider)
+
+    async def process_item(self, item, spider):
+        if isinstance(item, DockerDocsComposeSectionItem):
+            self.pages[item['url']]['sections'].append(ItemAdapter(item).asdict())
+        elif isinstance(item, DockerDocsComposeCodeItem):
+            self.pages[item['url']]['code'].append(ItemAdapter(item).asdict())
+        elif isinstance(item, DockerDocsComposeItem) and item.get('url'):
+            self.pages[item['url']]['page'] = ItemAdapter(item).asdict()
+        else:
+            return item
 
+        url = item['url']
+        group = self.pages[url]
+        page = group['page']
+        if (page is not None
+                and len(group['sections']) >= page.get('section_count', 0)
+                and len(group['code']) >= page.get('code_count', 0)):
+            await self.store_page(url, spider)
         return item
 
+    async def store_page(self, url, spider):
+        group = self.pages.pop(url)
+        position = operator.itemgetter('position')
+        await self.store({
+            'url': url,
+            'title': (group['page'] or {}).get('title'),
+            'sections': [
+                {'title': section.get('title'), 'content': section.get('content')}
+                for section in sorted(group['sections'], key=position)
+            ],
+            'code': [
+                {'language': code.get('language'), 'code': code.get('code')}
+                for code in sorted(group['code'], key=position)
+            ],
+        }, spider)
 
+    @classmethod
+    def item_key(cls, item_data):
+        return item_data.get('url')
 
+    @classmethod
+    async def write_batch(cls, conn, items):
+        for page in items:
+            # one transaction (a savepoint within the batch) per page
+            async with conn.transaction():
+                await cls.write_page(conn, page)
 
+    @classmethod
+    async def write_page(cls, conn, page):
+        url = page['url']
+        sections = page['sections']
+        code = page['code']
 
+        await conn.execute("""
+            INSERT INTO docker_docs_pages (url, title, content_hash)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (url)
+            DO UPDATE SET title = EXCLUDED.title, content_hash = EXCLUDED.content_hash, updated_at = now();
+        """, (url, page.get('title'), helpers.content_hash(page)), prepare=True)
+        await conn.execute("DELETE FROM docker_docs_sections WHERE url = %s;", (url,), prepare=True)
+        await conn.execute("DELETE FROM docker_docs_code WHERE url = %s;", (url,), prepare=True)
+        await conn.execute("""
+            INSERT INTO docker_docs_sections (url, position, title, content)
+            SELECT %s, * FROM unnest(%s::INTEGER[], %s::TEXT[], %s::TEXT[]);
+        """, (
+            url,
+            list(range(len(sections))),
+            [section['title'] for section in sections],
+            [section['content'] for section in sections],
+        ), prepare=True)
+        await conn.execute("""
+            INSERT INTO docker_docs_code (url, position, language, code)
+            SELECT %s, * FROM unnest(%s::INTEGER[], %s::TEXT[], %s::TEXT[]);
+        """, (
+            url,
+            list(range(len(code))),
+            [block['language'] for block in code],
+            [block['code'] for block in code],
+        ), prepare=True)
 
 
+# used by `scrapy replayspool` to write segments left behind by a crawl
+SPOOL_WRITERS = {
+    pipeline.kind: pipeline.write_batch
+    for pipeline in (
+        SaveRegistryToPostgresPipeline,
+        SaveBlogPostToPostgresPipeline,
+        SaveDocsComposeToPostgresPipeline,
+    )
+}
+SPOOL_WRITERS[SaveRegistryToPostgresPipeline.checked_kind] = SaveRegistryToPostgresPipeline.write_checked
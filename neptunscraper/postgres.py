@@ -0,0 +1,48 @@
+import asyncio
+
+from psycopg_pool import AsyncConnectionPool
+from scrapy import signals
+from scrapy.utils.defer import deferred_from_coro
+
+from neptunscraper import schema
+
+
+class PostgresPool:
+    """Async connection pool shared by every component of a crawler."""
+
+    def __init__(self, dsn, min_size=1, max_size=4, migrate=True):
+        self.pool = AsyncConnectionPool(dsn, min_size=min_size, max_size=max_size, open=False)
+        self.migrate = migrate
+        self.opening = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pool = getattr(crawler, 'postgres_pool', None)
+        if pool is None:
+            pool = cls(
+                crawler.settings.get('POSTGRES_DSN'),
+                min_size=crawler.settings.getint('POSTGRES_POOL_MIN_SIZE', 1),
+                max_size=crawler.settings.getint('POSTGRES_POOL_MAX_SIZE', 4),
+                migrate=crawler.settings.getbool('POSTGRES_MIGRATE', True),
+            )
+            crawler.postgres_pool = pool
+            crawler.signals.connect(pool.engine_stopped, signal=signals.engine_stopped)
+        return pool
+
+    async def open(self):
+        # every pipeline awaits the same task, so the pool is opened and migrated once
+        if self.opening is None:
+            self.opening = asyncio.ensure_future(self._open())
+        await self.opening
+
+    async def _open(self):
+        await self.pool.open(wait=True)
+        if self.migrate:
+            async with self.pool.connection() as conn:
+                await schema.migrate(conn)
+
+    def connection(self):
+        return self.pool.connection()
+
+    def engine_stopped(self):
+        return deferred_from_coro(self.pool.close())
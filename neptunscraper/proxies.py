@@ -0,0 +1,228 @@
+# Pool of HTTP proxies, scored by their latency and success rate.
+#
+# The list is loaded after the crawler started, from PROXY_POOL_FILE or
+# PROXY_POOL_URL, and every proxy is probed with a CONNECT to PROXY_POOL_PROBE_TARGET.
+# The ProxyPoolMiddleware assigns the proxies to requests and reports the outcome.
+
+import asyncio
+import logging
+import random
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from neptunscraper import helpers
+
+logger = logging.getLogger(__name__)
+
+# sent with the proxy and the reason, e.g. to close the Playwright context of the proxy
+proxy_evicted = object()
+
+
+def parse_proxy_list(lines):
+    # "1.2.3.4:8080", "http://1.2.3.4:8080"; blank lines and comments are skipped
+    proxies = []
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        proxies.append(line if '://' in line else f'http://{line}')
+    return list(dict.fromkeys(proxies))
+
+
+class Proxy:
+    def __init__(self, url, index):
+        self.url = url
+        # also names the Playwright context of the proxy
+        self.context = f'proxy-{index}'
+        self.latency = None
+        # None until the proxy was probed
+        self.success_rate = None
+        self.evicted = False
+
+    def record(self, success, latency=None, weight=0.3):
+        outcome = 1.0 if success else 0.0
+        # exponentially weighted, recent outcomes count more than old ones
+        if self.success_rate is None:
+            self.success_rate = outcome
+        else:
+            self.success_rate += weight * (outcome - self.success_rate)
+        if success and latency is not None:
+            self.latency = latency if self.latency is None else self.latency + weight * (latency - self.latency)
+
+    @property
+    def score(self):
+        return self.success_rate / (self.latency or 1.0)
+
+    @property
+    def host_port(self):
+        host_port = self.url.split('://', 1)[-1].rstrip('/')
+        host, _, port = host_port.rpartition(':')
+        return host, int(port) if port.isdigit() else 80
+
+
+class ProxyPool:
+    """Healthy proxies of the crawl.
+
+    A proxy is healthy while its success rate stays at or above `min_success_rate`.
+    It is evicted for good once it answers with a ban (403) or a 429, or once its
+    success rate drops below the minimum, which sends the `proxy_evicted` signal.
+    """
+
+    def __init__(self, stats, signals=None, source_file=None, source_url=None, probe_target='hub.docker.com:443',
+                 probe_timeout=5.0, probe_concurrency=50, reprobe_interval=300.0, min_success_rate=0.5,
+                 ready_proxies=5, ready_timeout=30.0):
+        self.stats = stats
+        self.signals = signals
+        self.source_file = source_file
+        self.source_url = source_url
+        self.probe_target = probe_target
+        self.probe_timeout = probe_timeout
+        self.probe_concurrency = probe_concurrency
+        self.reprobe_interval = reprobe_interval
+        self.min_success_rate = min_success_rate
+        # requests wait for this many healthy proxies, at most ready_timeout seconds
+        self.ready_proxies = ready_proxies
+        self.ready_timeout = ready_timeout
+        self.proxies = []
+        self.by_url = {}
+        self.ready = None
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pool = getattr(crawler, 'proxy_pool', None)
+        if pool is not None:
+            return pool
+
+        settings = crawler.settings
+        if not settings.get('PROXY_POOL_FILE') and not settings.get('PROXY_POOL_URL'):
+            raise NotConfigured
+        pool = cls(
+            crawler.stats,
+            signals=crawler.signals,
+            source_file=settings.get('PROXY_POOL_FILE'),
+            source_url=settings.get('PROXY_POOL_URL'),
+            probe_target=settings.get('PROXY_POOL_PROBE_TARGET', 'hub.docker.com:443'),
+            probe_timeout=settings.getfloat('PROXY_POOL_PROBE_TIMEOUT', 5.0),
+            probe_concurrency=settings.getint('PROXY_POOL_PROBE_CONCURRENCY', 50),
+            reprobe_interval=settings.getfloat('PROXY_POOL_REPROBE_INTERVAL', 300.0),
+            min_success_rate=settings.getfloat('PROXY_POOL_MIN_SUCCESS_RATE', 0.5),
+            ready_proxies=settings.getint('PROXY_POOL_READY_PROXIES', 5),
+            ready_timeout=settings.getfloat('PROXY_POOL_READY_TIMEOUT', 30.0),
+        )
+        crawler.proxy_pool = pool
+        crawler.signals.connect(pool.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(pool.spider_closed, signal=signals.spider_closed)
+        return pool
+
+    def spider_opened(self, spider):
+        # not awaited by the engine, the crawl starts while the proxies are probed
+        self.ready = asyncio.get_event_loop().create_future()
+        self.task = asyncio.ensure_future(self.run())
+
+    def spider_closed(self, spider):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def wait_until_ready(self):
+        if self.ready is None or self.ready.done():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self.ready), self.ready_timeout or None)
+        except asyncio.TimeoutError:
+            # few healthy proxies in a long list, the requests use the ones found so far or go out directly
+            logger.info(f"Sending requests with {len(self.healthy())} healthy proxies, "
+                        f"the others are still being probed")
+            self.set_ready()
+
+    async def run(self):
+        try:
+            urls = await self.load()
+            self.proxies = [Proxy(url, index) for index, url in enumerate(urls)]
+            self.by_url = {proxy.url: proxy for proxy in self.proxies}
+            self.stats.set_value('proxy_pool/loaded', len(self.proxies))
+            while True:
+                await self.probe_all()
+                self.set_ready()
+                logger.info(f"{len(self.healthy())} of {len(self.proxies)} proxies are healthy")
+                await asyncio.sleep(self.reprobe_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Could not load the proxy list, crawling without proxies: {e}")
+        finally:
+            self.set_ready()
+
+    def set_ready(self):
+        if not self.ready.done():
+            self.ready.set_result(None)
+
+    async def load(self):
+        if self.source_file:
+            with open(self.source_file, encoding='utf-8') as f:
+                return parse_proxy_list(f)
+        lines = await asyncio.to_thread(helpers.fetch_and_parse_proxies, self.source_url)
+        return parse_proxy_list(lines)
+
+    async def probe_all(self):
+        semaphore = asyncio.Semaphore(self.probe_concurrency)
+
+        async def probe(proxy):
+            async with semaphore:
+                await self.probe(proxy)
+
+        await asyncio.gather(*(probe(proxy) for proxy in self.proxies if not proxy.evicted))
+        self.stats.set_value('proxy_pool/healthy', len(self.healthy()))
+
+    async def probe(self, proxy):
+        started = time.monotonic()
+        writer = None
+        try:
+            host, port = proxy.host_port
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.probe_timeout)
+            writer.write(f'CONNECT {self.probe_target} HTTP/1.1\r\nHost: {self.probe_target}\r\n\r\n'.encode('ascii'))
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), self.probe_timeout)
+            success = status_line.split(b' ')[1:2] == [b'200']
+        except (OSError, asyncio.TimeoutError, ValueError):
+            success = False
+        finally:
+            if writer is not None:
+                writer.close()
+
+        self.stats.inc_value(f'proxy_pool/probes/{"ok" if success else "failed"}')
+        self.record(proxy, success, time.monotonic() - started)
+        if success and not self.ready.done() and len(self.healthy()) >= self.ready_proxies:
+            # the other proxies are probed while the crawl runs
+            logger.info(f"Found {self.ready_proxies} healthy proxies, starting to send requests")
+            self.set_ready()
+
+    def get(self, url):
+        return self.by_url.get(url)
+
+    def healthy(self):
+        return [proxy for proxy in self.proxies if not proxy.evicted and proxy.success_rate is not None]
+
+    def choose(self, proxies=None):
+        healthy = self.healthy() if proxies is None else [proxy for proxy in proxies if not proxy.evicted]
+        if not healthy:
+            return None
+        # better scored proxies get more requests, the others still get some to update their score
+        return random.choices(healthy, weights=[proxy.score for proxy in healthy])[0]
+
+    def record(self, proxy, success, latency=None):
+        proxy.record(success, latency)
+        if not proxy.evicted and proxy.success_rate < self.min_success_rate:
+            self.evict(proxy, 'failures')
+
+    def evict(self, proxy, reason):
+        if proxy.evicted:
+            return
+        proxy.evicted = True
+        self.stats.inc_value(f'proxy_pool/evicted/{reason}')
+        self.stats.set_value('proxy_pool/healthy', len(self.healthy()))
+        logger.debug(f"Evicted proxy {proxy.url} ({reason})")
+        if self.signals is not None:
+            self.signals.send_catch_log(proxy_evicted, proxy=proxy, reason=reason)
@@ -0,0 +1,248 @@
+# Database schema of the scraped data.
+#
+# Migrations are applied in order and recorded in schema_migrations, so every
+# statement runs exactly once per database. Append new migrations to the end,
+# never edit one that has already been released.
+
+# arbitrary key for pg_advisory_xact_lock, serializes concurrent migrators
+MIGRATION_LOCK_ID = 7_263_514
+
+MIGRATIONS = [
+    ("create docker_images and docker_blog_posts", """
+        CREATE TABLE IF NOT EXISTS docker_images (
+            name TEXT PRIMARY KEY,
+            details JSONB
+        );
+        CREATE TABLE IF NOT EXISTS docker_blog_posts (
+            title TEXT PRIMARY KEY,
+            details JSONB
+        );
+    """),
+    ("add content hashes", """
+        ALTER TABLE docker_images ADD COLUMN IF NOT EXISTS content_hash BYTEA;
+        ALTER TABLE docker_blog_posts ADD COLUMN IF NOT EXISTS content_hash BYTEA;
+    """),
+    ("normalize docker_images into typed columns and docker_image_tags", r"""
+        -- same rules as helpers.parse_count: "1B+", "500K+", "10M", "4,210"
+        CREATE OR REPLACE FUNCTION neptun_parse_count(value TEXT) RETURNS BIGINT AS $$
+        DECLARE
+            cleaned TEXT := upper(replace(rtrim(trim(value), '+'), ',', ''));
+            multiplier BIGINT := 1;
+        BEGIN
+            IF right(cleaned, 1) = 'K' THEN
+                multiplier := 1000;
+            ELSIF right(cleaned, 1) = 'M' THEN
+                multiplier := 1000000;
+            ELSIF right(cleaned, 1) = 'B' THEN
+                multiplier := 1000000000;
+            END IF;
+            IF multiplier > 1 THEN
+                cleaned := left(cleaned, -1);
+            END IF;
+            IF cleaned IS NULL OR cleaned !~ '^[0-9]+(\.[0-9]+)?$' THEN
+                RETURN NULL;
+            END IF;
+            RETURN (cleaned::NUMERIC * multiplier)::BIGINT;
+        END;
+        $$ LANGUAGE plpgsql IMMUTABLE;
+
+        ALTER TABLE docker_images
+            ADD COLUMN uploader TEXT,
+            ADD COLUMN is_official_image BOOLEAN,
+            ADD COLUMN is_verified_publisher BOOLEAN,
+            ADD COLUMN last_update TEXT,
+            ADD COLUMN description TEXT,
+            ADD COLUMN chips TEXT[] NOT NULL DEFAULT '{}',
+            ADD COLUMN downloads BIGINT,
+            ADD COLUMN stars BIGINT,
+            ADD COLUMN pulls_last_week BIGINT,
+            ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+        CREATE TABLE docker_image_tags (
+            image_name TEXT NOT NULL REFERENCES docker_images (name) ON DELETE CASCADE,
+            version TEXT NOT NULL,
+            type_name TEXT NOT NULL,
+            PRIMARY KEY (image_name, version, type_name)
+        );
+
+        UPDATE docker_images SET
+            uploader = details ->> 'uploader',
+            is_official_image = (details ->> 'is_official_image')::BOOLEAN,
+            is_verified_publisher = (details ->> 'is_verified_publisher')::BOOLEAN,
+            last_update = details ->> 'last_update',
+            description = details ->> 'description',
+            chips = CASE WHEN jsonb_typeof(details -> 'chips') = 'array'
+                THEN ARRAY(SELECT jsonb_array_elements_text(details -> 'chips'))
+                ELSE '{}' END,
+            downloads = neptun_parse_count(details ->> 'downloads'),
+            stars = neptun_parse_count(details ->> 'stars'),
+            pulls_last_week = neptun_parse_count(details ->> 'pulls_last_week')
+        WHERE details IS NOT NULL;
+
+        INSERT INTO docker_image_tags (image_name, version, type_name)
+        SELECT image.name, tag_group.key, type_name.value
+        FROM docker_images image,
+            jsonb_each(CASE WHEN jsonb_typeof(image.details -> 'tags') = 'object'
+                THEN image.details -> 'tags' ELSE '{}' END) tag_group,
+            jsonb_array_elements_text(CASE WHEN jsonb_typeof(tag_group.value) = 'array'
+                THEN tag_group.value ELSE '[]' END) type_name
+        ON CONFLICT DO NOTHING;
+
+        ALTER TABLE docker_images DROP COLUMN details;
+
+        CREATE INDEX docker_images_downloads_idx ON docker_images (downloads DESC NULLS LAST);
+        CREATE INDEX docker_images_stars_idx ON docker_images (stars DESC NULLS LAST);
+        CREATE INDEX docker_images_pulls_last_week_idx ON docker_images (pulls_last_week DESC NULLS LAST);
+        CREATE INDEX docker_images_chips_idx ON docker_images USING GIN (chips);
+        CREATE INDEX docker_images_description_idx ON docker_images
+            USING GIN (to_tsvector('english', coalesce(description, '')));
+        CREATE INDEX docker_image_tags_type_name_idx ON docker_image_tags (type_name);
+    """),
+    ("store blog posts, sections and code blocks in separate tables", """
+        ALTER TABLE docker_blog_posts RENAME TO docker_blog_posts_legacy;
+        ALTER TABLE docker_blog_posts_legacy RENAME CONSTRAINT docker_blog_posts_pkey TO docker_blog_posts_legacy_pkey;
+
+        -- ids are md5(url)::uuid, see helpers.stable_id
+        CREATE TABLE docker_blog_posts (
+            id UUID PRIMARY KEY,
+            url TEXT UNIQUE,
+            title TEXT,
+            content TEXT,
+            authors TEXT[] NOT NULL DEFAULT '{}',
+            categories TEXT[] NOT NULL DEFAULT '{}',
+            post_tags TEXT[] NOT NULL DEFAULT '{}',
+            posted_on TEXT,
+            content_hash BYTEA,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE TABLE docker_blog_post_sections (
+            post_id UUID NOT NULL REFERENCES docker_blog_posts (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            title TEXT,
+            content TEXT,
+            PRIMARY KEY (post_id, position)
+        );
+
+        CREATE TABLE docker_blog_post_code (
+            post_id UUID NOT NULL,
+            section_position INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            content TEXT,
+            PRIMARY KEY (post_id, section_position, position),
+            FOREIGN KEY (post_id, section_position)
+                REFERENCES docker_blog_post_sections (post_id, position) ON DELETE CASCADE
+        );
+
+        -- the old rows carry no url, they are keyed by their title until they are crawled again
+        INSERT INTO docker_blog_posts (id, title, content, authors, categories, post_tags, posted_on)
+        SELECT
+            md5(title)::UUID,
+            title,
+            details ->> 'content',
+            ARRAY(SELECT jsonb_array_elements_text(CASE WHEN jsonb_typeof(details -> 'authors') = 'array'
+                THEN details -> 'authors' ELSE '[]' END)),
+            ARRAY(SELECT jsonb_array_elements_text(CASE WHEN jsonb_typeof(details -> 'categories') = 'array'
+                THEN details -> 'categories' ELSE '[]' END)),
+            ARRAY(SELECT jsonb_array_elements_text(CASE WHEN jsonb_typeof(details -> 'post_tags') = 'array'
+                THEN details -> 'post_tags' ELSE '[]' END)),
+            details ->> 'posted_on'
+        FROM docker_blog_posts_legacy;
+
+        INSERT INTO docker_blog_post_sections (post_id, position, title, content)
+        SELECT md5(legacy.title)::UUID, section.position - 1, section.value ->> 'title', section.value ->> 'content'
+        FROM docker_blog_posts_legacy legacy,
+            jsonb_array_elements(CASE WHEN jsonb_typeof(legacy.details -> 'sections') = 'array'
+                THEN legacy.details -> 'sections' ELSE '[]' END) WITH ORDINALITY AS section (value, position);
+
+        INSERT INTO docker_blog_post_code (post_id, section_position, position, content)
+        SELECT md5(legacy.title)::UUID, section.position - 1, code.position - 1, code.value ->> 'content'
+        FROM docker_blog_posts_legacy legacy,
+            jsonb_array_elements(CASE WHEN jsonb_typeof(legacy.details -> 'sections') = 'array'
+                THEN legacy.details -> 'sections' ELSE '[]' END) WITH ORDINALITY AS section (value, position),
+            jsonb_array_elements(CASE WHEN jsonb_typeof(section.value -> 'code') = 'array'
+                THEN section.value -> 'code' ELSE '[]' END) WITH ORDINALITY AS code (value, position);
+
+        DROP TABLE docker_blog_posts_legacy;
+
+        CREATE INDEX docker_blog_posts_title_idx ON docker_blog_posts (title);
+        CREATE INDEX docker_blog_posts_post_tags_idx ON docker_blog_posts USING GIN (post_tags);
+    """),
+    ("store docker compose docs pages with their sections and code", """
+        CREATE TABLE docker_docs_pages (
+            url TEXT PRIMARY KEY,
+            title TEXT,
+            content_hash BYTEA,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE TABLE docker_docs_sections (
+            url TEXT NOT NULL REFERENCES docker_docs_pages (url) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            title TEXT,
+            content TEXT,
+            PRIMARY KEY (url, position)
+        );
+
+        CREATE TABLE docker_docs_code (
+            url TEXT NOT NULL REFERENCES docker_docs_pages (url) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            language TEXT,
+            code TEXT,
+            PRIMARY KEY (url, position)
+        );
+    """),
+    ("add the estimated update time of docker images", r"""
+        ALTER TABLE docker_images ADD COLUMN last_updated_at TIMESTAMPTZ;
+
+        -- rows fetched from the API hold a timestamp, the relative texts of the web app are estimated on the next crawl
+        UPDATE docker_images SET last_updated_at = last_update::TIMESTAMPTZ
+        WHERE last_update ~ '^\d{4}-\d{2}-\d{2}T';
+    """),
+    ("add the crawl frontier shared by the workers of a crawl", """
+        -- see frontier.PostgresFrontierScheduler; request holds the pickled Request.to_dict()
+        CREATE TABLE crawl_frontier (
+            id BIGSERIAL,
+            crawl TEXT NOT NULL,
+            fingerprint BYTEA NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            request BYTEA NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending' CHECK (state IN ('pending', 'leased', 'done')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires_at TIMESTAMPTZ,
+            enqueued_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (crawl, fingerprint)
+        );
+
+        CREATE INDEX crawl_frontier_claim_idx ON crawl_frontier (crawl, priority DESC, id) WHERE state <> 'done';
+    """),
+    ("add the time docker images were last checked", """
+        -- updated_at only moves when the content changes, delta crawls need the last fetch
+        ALTER TABLE docker_images ADD COLUMN checked_at TIMESTAMPTZ;
+        UPDATE docker_images SET checked_at = updated_at;
+    """),
+]
+
+
+async def migrate(conn):
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+        cursor = await conn.execute("SELECT version FROM schema_migrations")
+        applied = {version for (version,) in await cursor.fetchall()}
+
+        for version, (description, statements) in enumerate(MIGRATIONS, start=1):
+            if version in applied:
+                continue
+            await conn.execute(statements)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description),
+            )
@@ -6,13 +6,13 @@
 #     https://docs.scrapy.org/en/latest/topics/settings.html
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-from . import helpers
-import random
+import os
 
 BOT_NAME = "neptunscraper"
 
 SPIDER_MODULES = ["neptunscraper.spiders"]
 NEWSPIDER_MODULE = "neptunscraper.spiders"
+COMMANDS_MODULE = "neptunscraper.commands"
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -41,20 +41,127 @@ ITEM_PIPELINES = {
     'neptunscraper.pipelines.SaveRegistryToPostgresPipeline': 300,
 }
 
-# REDIRECT_ENABLED = True
-# RETRY_HTTP_CODES = [429]
+# worker processes of the HtmlToTextPipeline (0 for one per CPU) and the number of
+# items converted at once (0 for twice the workers)
+HTML_TO_TEXT_WORKERS = 0
+HTML_TO_TEXT_MAX_PENDING = 0
+
+# "api" fetches Docker Hub images over its JSON endpoints and only renders pages in
+# Playwright when the API fails, "browser" always renders. Spiders accept -a mode=...
+DOCKERHUB_DOWNLOAD_MODE = "api"
+# Point this to a mock server to test the API mode locally
+DOCKERHUB_API_URL = "https://hub.docker.com"
+# API requests are downloaded in this slot of DOWNLOAD_SLOTS instead of the throttled one of the rendered pages
+DOCKERHUB_API_DOWNLOAD_SLOT = "dockerhub-api"
+DOCKERHUB_SEARCH_PAGE_SIZE = 25
+# The search spiders schedule all result pages at once from the result count of the
+# first page, at most this many (0 for no limit); -a depth=N limits them per crawl
+DOCKERHUB_SEARCH_MAX_PAGES = 100
+DOCKERHUB_TAGS_PAGE_SIZE = 100
+# Delta crawls (-a delta=1) skip images that were not updated since they were stored,
+# images last fetched longer ago than DOCKERHUB_DELTA_MAX_AGE_DAYS are fetched regardless (0 disables it)
+DOCKERHUB_DELTA_ENABLED = False
+DOCKERHUB_DELTA_MAX_AGE_DAYS = 7
+
+# Columnar feed format, e.g. FEEDS = {"images.parquet": {"format": "parquet", "item_classes": [...]}}
+FEED_EXPORTERS = {
+    "parquet": "neptunscraper.exporters.ParquetItemExporter",
+}
+FEED_PARQUET_ROW_GROUP_SIZE = 10000
+FEED_PARQUET_COMPRESSION = "zstd"
+
+# DockerPipeline sorts items in segments of this size and merges them on close
+DOCKER_PIPELINE_SEGMENT_SIZE = 1000
 
-ROTATING_PROXY_LIST = helpers.fetch_and_parse_proxies('https://raw.githubusercontent.com/TheSpeedX/SOCKS-List/master/http.txt')
+# Connection pool shared by all PostgreSQL pipelines of a crawl
+POSTGRES_DSN = os.environ.get(
+    "POSTGRES_DSN", "dbname=neptun_data user=root password=secret host=localhost port=5432"
+)
+POSTGRES_POOL_MIN_SIZE = 1
+POSTGRES_POOL_MAX_SIZE = 4
+# Apply pending neptunscraper.schema migrations when the pool is opened
+POSTGRES_MIGRATE = True
 
+# Items are spooled to disk and written in batches, flushed after N items or every T seconds
+POSTGRES_BATCH_SIZE = 500
+POSTGRES_FLUSH_INTERVAL = 30
+
+# On-disk spool of the PostgreSQL pipelines, replay leftovers with `scrapy replayspool`.
+# Every job spools into its own locked directory (SCRAPY_JOB or host and pid), segments
+# of jobs that died are picked up by the next job of the spider
+SPOOL_DIR = "spool"
+# Pause the crawl while this many segments wait to be written (0 disables it)
+SPOOL_MAX_PENDING_SEGMENTS = 20
+SPOOL_FSYNC = False
+
+# Share the queue and the seen requests of a crawl between scrapyd nodes through PostgreSQL.
+# Workers with the same FRONTIER_CRAWL (or -a frontier=..., the spider name by default)
+# split the crawl; a lease that is not completed within FRONTIER_LEASE_SECONDS is taken
+# over by another worker, at most FRONTIER_MAX_ATTEMPTS times
+#SCHEDULER = "neptunscraper.frontier.PostgresFrontierScheduler"
+
+# Pause and resume crawls with -s JOBDIR=jobs/<name>: the pending requests are kept in
+# zlib compressed disk queues and the seen fingerprints as raw bytes
+DUPEFILTER_CLASS = "neptunscraper.jobstate.CompactDupeFilter"
+SCHEDULER_DISK_QUEUE = "neptunscraper.jobstate.ZlibPickleLifoDiskQueue"
+FRONTIER_CRAWL = None
+FRONTIER_LEASE_SECONDS = 600
+FRONTIER_PREFETCH = 16
+FRONTIER_MAX_ATTEMPTS = 3
+FRONTIER_POLL_INTERVAL = 0.5
+
+# REDIRECT_ENABLED = True
+# RETRY_HTTP_CODES = [429]
 
 DOWNLOADER_MIDDLEWARES = {
-  #  'rotating_proxies.middlewares.RotatingProxyMiddleware': 610,
-  #  'rotating_proxies.middlewares.BanDetectionMiddleware': 620,
-  #  'scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware': 110,
-  #  'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
-  #  'neptunscraper.middlewares.TooManyRequestsRetryMiddleware': 543,
+    'neptunscraper.middlewares.RequestRulesMiddleware': 50,
+    'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
+    'neptunscraper.middlewares.RateLimitRetryMiddleware': 550,
+    # sees responses before the rate limit middleware, so a 429 evicts the proxy before the retry picks another one
+    'neptunscraper.middlewares.ProxyPoolMiddleware': 560,
+    # after the HTTP cache (900), which keys rendered pages on the page method specs
+    'neptunscraper.middlewares.PageMethodSpecMiddleware': 940,
+    'neptunscraper.middlewares.PlaywrightPagePoolMiddleware': 950,
 }
 
+# Allow/deny rules for the URL and the referer of requests, the middleware is disabled without rules, e.g.
+# {"action": "deny", "target": "referer", "substring": "/login"}
+# {"action": "deny", "target": "url", "host": "doubleclick.net", "name": "ads"}
+# {"action": "allow", "target": "url", "regex": r"/tags$"}
+REQUEST_RULES = []
+BLOCKED_REFERER_URLS = []
+
+# Proxies are loaded and probed after the crawl started, the pool is disabled while no source is set, e.g.
+# PROXY_POOL_URL = "https://raw.githubusercontent.com/TheSpeedX/SOCKS-List/master/http.txt"
+PROXY_POOL_FILE = os.environ.get("PROXY_POOL_FILE")
+PROXY_POOL_URL = os.environ.get("PROXY_POOL_URL")
+PROXY_POOL_PROBE_TARGET = "hub.docker.com:443"
+PROXY_POOL_PROBE_TIMEOUT = 5.0
+PROXY_POOL_PROBE_CONCURRENCY = 50
+PROXY_POOL_REPROBE_INTERVAL = 300.0
+PROXY_POOL_MIN_SUCCESS_RATE = 0.5
+# requests wait until this many proxies passed their probe (at most PROXY_POOL_READY_TIMEOUT seconds),
+# not for the probe of the whole list
+PROXY_POOL_READY_PROXIES = 5
+PROXY_POOL_READY_TIMEOUT = 30.0
+PROXY_POOL_BAN_CODES = [403, 429]
+# Playwright requests go through at most this many proxies (a browser context each)
+PROXY_POOL_MAX_CONTEXTS = 8
+
+# 429 responses pause their download slot (Retry-After, X-RateLimit-Reset or jittered exponential backoff)
+RATELIMIT_MAX_RETRIES = 10
+RATELIMIT_BACKOFF_BASE = 5.0
+RATELIMIT_MAX_DELAY = 600.0
+# requests of a paused slot that do not count against CONCURRENT_REQUESTS while they wait
+RATELIMIT_MAX_PARKED_REQUESTS = 8
+
+# Warm Playwright pages are kept per context and reused by the next request
+PLAYWRIGHT_PAGE_POOL_ENABLED = True
+PLAYWRIGHT_PAGE_POOL_SIZE = 4
+PLAYWRIGHT_PAGE_POOL_MAX_USES = 50
+
+# Rendered pages are downloaded one at a time, at least DOWNLOAD_DELAY apart and slowed down
+# further by AutoThrottle. Other download slots, e.g. the Docker Hub API, use DOWNLOAD_SLOTS.
 AUTOTHROTTLE_ENABLED = True
 AUTOTHROTTLE_START_DELAY = 5
 AUTOTHROTTLE_MAX_DELAY = 60
@@ -62,29 +169,49 @@ AUTOTHROTTLE_TARGET_CONCURRENCY = 0.5
 AUTOTHROTTLE_DEBUG = True
 
 DOWNLOAD_DELAY = 5
-CONCURRENT_REQUESTS = 1
+# the total over all slots, a single slot is limited by the per domain/IP concurrency or DOWNLOAD_SLOTS
+CONCURRENT_REQUESTS = 8
 CONCURRENT_REQUESTS_PER_DOMAIN = 1
 CONCURRENT_REQUESTS_PER_IP = 1
+DOWNLOAD_SLOTS = {
+    "dockerhub-api": {"concurrency": 4, "delay": 0.5, "randomize_delay": True},
+}
 
 LOG_LEVEL = 'DEBUG'
 
-PLAYWRIGHT_ABORT_REQUEST = helpers.should_abort_request
+EXTENSIONS = {
+    'scrapy.extensions.throttle.AutoThrottle': None,
+    'neptunscraper.extensions.SlotAutoThrottle': 0,
+    'neptunscraper.extensions.ResourcePolicyExtension': 500,
+}
 
-# PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT = 1 * 1000
-'''
-PLAYWRIGHT_CONTEXTS = {
-    "default": {
-        "proxy": {
-            "server": random.choice(helpers.fetch_and_parse_proxies('https://raw.githubusercontent.com/TheSpeedX/SOCKS-List/master/http.txt')),
-        },
-    },
-    "alternative": {
-        "proxy": {
-            "server": random.choice(helpers.fetch_and_parse_proxies('https://raw.githubusercontent.com/TheSpeedX/SOCKS-List/master/http.txt')),
-        },
-    }
+# Requests of rendered pages that are aborted in the browser, spiders override it in their custom_settings.
+# The Docker Hub app needs its scripts and API calls, styles, media and trackers are not needed to scrape it.
+PLAYWRIGHT_RESOURCE_POLICY = {
+    'allowed_resource_types': ['document', 'script', 'xhr', 'fetch'],
+    'blocked_domains': [
+        'google-analytics.com',
+        'googletagmanager.com',
+        'doubleclick.net',
+        'googlesyndication.com',
+        'segment.com',
+        'segment.io',
+        'sentry.io',
+        'optimizely.com',
+        'hotjar.com',
+        'newrelic.com',
+        'nr-data.net',
+        'cookielaw.org',
+        'onetrust.com',
+        'launchdarkly.com',
+        'bizible.com',
+        'marketo.net',
+        'demdex.net',
+        'pendo.io',
+    ],
 }
-'''
+
+# PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT = 1 * 1000
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -146,10 +273,15 @@ PLAYWRIGHT_CONTEXTS = {
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 #HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_EXPIRATION_SECS = 24 * 60 * 60
 #HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# a cached rate limit or server error would be served to every retry
+HTTPCACHE_IGNORE_HTTP_CODES = [429, 500, 502, 503, 504]
+# rendered responses, zstd compressed in a single SQLite file (requires `poetry install -E cache`)
+HTTPCACHE_STORAGE = "neptunscraper.httpcache.SqliteZstdCacheStorage"
+HTTPCACHE_SQLITE_FILE = "responses.sqlite"
+HTTPCACHE_MAX_BYTES = 512 * 1024 * 1024
+HTTPCACHE_ZSTD_LEVEL = 3
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -1,6 +1,5 @@
 import scrapy
 from scrapy.spiders import Rule, CrawlSpider
-from scrapy_playwright.page import PageMethod
 from scrapy.linkextractors import LinkExtractor
 from neptunscraper.items import DockerDocsComposeItem, DockerDocsComposeSectionItem, DockerDocsComposeCodeItem
 
@@ -15,6 +14,12 @@ class DockerDocsComposeSpider(CrawlSpider):
     allowed_domains = ['docs.docker.com']
     start_urls = ['https://docs.docker.com/compose']
 
+    custom_settings = {
+        'ITEM_PIPELINES': {
+            'neptunscraper.pipelines.HtmlToTextPipeline': 200,
+            'neptunscraper.pipelines.SaveDocsComposeToPostgresPipeline': 300,
+        }
+    }
 
     rules = (
         Rule(
@@ -40,20 +45,26 @@ class DockerDocsComposeSpider(CrawlSpider):
         self.logger.info(f"Parsing page: {response.url}")
 
         # Parse content sections
-        for section in response.xpath('//main//section'):
+        sections = response.xpath('//main//section')
+        for position, section in enumerate(sections):
             section_title = section.xpath('.//h2/text()').get(default='No Title').strip()
-            section_content = section.xpath('.//div[contains(@class, "content")]/descendant-or-self::*').getall()
+            # the outermost content blocks, the HtmlToTextPipeline converts them to markdown
+            section_content = section.xpath(
+                './/div[contains(@class, "content")][not(ancestor::div[contains(@class, "content")])]'
+            ).getall()
 
             # Create section item
             section_item = DockerDocsComposeSectionItem(
                 title=section_title,
                 content=''.join(section_content),
-                url=response.url
+                url=response.url,
+                position=position
             )
             yield section_item
 
         # Parse code snippets
-        for code_block in response.xpath('//pre'):
+        code_blocks = response.xpath('//pre')
+        for position, code_block in enumerate(code_blocks):
             code_content = code_block.xpath('text()').get()
             code_language = code_block.xpath('@class').re_first(r'language-(\w+)')
 
@@ -66,7 +77,15 @@ class DockerDocsComposeSpider(CrawlSpider):
             code_item = DockerDocsComposeCodeItem(
                 language=code_language,
                 code=code_content,
-                url=response.url
+                url=response.url,
+                position=position
             )
             yield code_item
 
+        yield DockerDocsComposeItem(
+            url=response.url,
+            title=title,
+            section_count=len(sections),
+            code_count=len(code_blocks)
+        )
+
@@ -1,13 +1,28 @@
 import scrapy
 from scrapy.spiders import Rule, CrawlSpider
-from scrapy_playwright.page import PageMethod
-from scrapy.crawler import CrawlerProcess
 from scrapy.linkextractors import LinkExtractor
+from neptunscraper import helpers
+from neptunscraper.delta import DeltaCrawlMixin
+from neptunscraper.dockerhub_api import DockerHubApiMixin, image_page_url
+from neptunscraper.extractors import extract_image_item
 from neptunscraper.items import DockerImageItem
-import re
 
 
-class DockerhubQueriedRegistrySpider(CrawlSpider):
+def parse_queries(value=None, lines=()):
+    # "python,bitnami/python" and/or one name per line; blank lines and comments are skipped
+    names = (value or '').split(',') + [line.split('#', 1)[0] for line in lines]
+    queries = []
+    for name in names:
+        name = name.strip().strip('/').lower()
+        # official images are also reachable as library/<name>
+        if name.startswith('library/'):
+            name = name[len('library/'):]
+        if name:
+            queries.append(name)
+    return list(dict.fromkeys(queries))
+
+
+class DockerhubQueriedRegistrySpider(DeltaCrawlMixin, DockerHubApiMixin, CrawlSpider):
     name = "dockerhubQueriedRegistrySpider"
     allowed_domains = ["hub.docker.com"]
 
@@ -30,116 +45,74 @@ class DockerhubQueriedRegistrySpider(CrawlSpider):
         )
     )
 
-    def __init__(self, query=None, *args, **kwargs):
+    def __init__(self, query=None, queries=None, queries_file=None, mode=None, *args, **kwargs):
         super(DockerhubQueriedRegistrySpider, self).__init__(*args, **kwargs)
-        self.query = query
-        # check whether: username/image or image
-        self.start_urls = [f'https://hub.docker.com/r/{query}/tags' if '/' in query and len(
-            query.split('/')) == 2 else f'https://hub.docker.com/_/{query}/tags']
+        # one image (-a query=python), a list (-a queries=python,node) or a file with one image per line
+        lines = []
+        if queries_file:
+            with open(queries_file, encoding='utf-8') as f:
+                lines = f.readlines()
+        self.queries = parse_queries(','.join(filter(None, (query, queries))), lines)
+        if not self.queries:
+            raise ValueError("dockerhubQueriedRegistrySpider needs a query, queries or queries_file argument")
+        self.query = self.queries[0]
+        # "api" (JSON endpoints, the default) or "browser" (Playwright), see DOCKERHUB_DOWNLOAD_MODE
+        self.download_mode = mode
+        self.start_urls = [image_page_url(name) for name in self.queries]
+        self.finished = {}
 
     def start_requests(self):
-        self.logger.info(f"Starting request: {self.start_urls[0]}")
-        yield scrapy.Request(
-            self.start_urls[0],
+        self.logger.info(f"Crawling {len(self.queries)} images")
+        # all queries are scheduled at once and share the browser and the database connections,
+        # API requests are downloaded concurrently, rendered pages one at a time (see DOWNLOAD_SLOTS)
+        for name in self.queries:
+            if self.use_api():
+                yield self.api_repository_request(name)
+            else:
+                yield self.browser_request(name)
+
+    def browser_fallback(self, request):
+        return self.browser_request(request.meta['dockerhub_image'])
+
+    def browser_request(self, name):
+        return scrapy.Request(
+            image_page_url(name),
             meta=dict(
+                dockerhub_image=name,
                 playwright=True,
-                playwright_include_page=True,
                 playwright_page_methods=[
-                    PageMethod("wait_for_selector", 'div[data-testid="repotagsTagList"]'),
+                    helpers.page_method("wait_for_selector", 'div[data-testid="repotagsTagList"]'),
                 ]
             ),
-            callback=self.parse_registry
+            callback=self.parse_registry,
+            errback=self.browser_errback,
         )
 
     def parse_registry(self, response):
-        item = DockerImageItem()
-
-        # Name of the repository (check both <h1> and <h2>)
-        name = response.css('h1.MuiTypography-h2::text, h2.MuiTypography-h2::text').get()
-        item['name'] = name.strip() if name else None
-
-        # Determine if the publisher is verified
-        verified_publisher_icon = response.css('svg[data-testid="official-icon"]')
-        item["is_verified_publisher"] = bool(verified_publisher_icon)
-
-        # Extract downloads
-        downloads_elem = response.css('svg[data-testid="DownloadIcon"] + p.MuiTypography-body1::text').get()
-        item['downloads'] = self.parse_downloads(downloads_elem) if downloads_elem else response.css(
-            'p.MuiTypography-body1:nth-child(3)::text').get()
-
-        description = response.css('p[data-testid="description"]::text').get()
-
-        if not description:
-            description = response.css('p.MuiTypography-body1:nth-child(3)::text').get()
-            if str(item['downloads']) in str(description):
-                description = None
-        item['description'] = description
-
-        # Chips (Tags)
-        item['chips'] = [chip.strip() for chip in response.css('span.MuiChip-labelSmall::text').getall() if
-                         chip.strip().lower() not in ["new", "image"]]
-
-        stars_text = response.css('svg[data-testid="StarOutlineIcon"] + span.MuiTypography-body1 strong::text').get()
-        item['stars'] = stars_text.strip() if stars_text else None
-
-        tags = {}
-
-        tag_items = response.css('div[data-testid="repotagsTagListItem"]')
-        for tag_item in tag_items:
-            tag_name = tag_item.css('a[data-testid="navToImage"]::text').get()
-
-            if tag_name:
-                tag_version = self.extract_type_and_version(tag_name)
-                if tag_version:
-                    type_name, version = tag_version
-                    tags.setdefault(version, []).append(type_name)
-                else:
-                    tags.setdefault('default', []).append(tag_name)
-            else:
-                tags.setdefault('default', []).append("")
-
-        formatted_tags = {}
-        for key, values in tags.items():
-            formatted_tags[key] = values
-
-            item['tags'] = formatted_tags
-        yield item
-
-    def extract_type_and_version(self, tag_name):
-        if tag_name and '-' in tag_name:
-            parts = tag_name.rsplit('-', 1)
-            if len(parts) == 2:
-                return parts[0], parts[1]
-
-        return None
-
-    def parse_downloads(self, downloads_elem):
-        if not downloads_elem:
-            return None
-
-        # Remove non-numeric characters
-        downloads_elem = re.sub(r'\D', '', downloads_elem)
-
-        # Check if the resulting string has a length > 0
-        if len(downloads_elem) == 0:
-            return None
-
-        # Convert the remaining string to an integer
-        try:
-            downloads = int(downloads_elem)
-        except ValueError:
-            return None
-
-        return downloads
-
-    @staticmethod
-    def parse_update_string(update_string):
-        return update_string.strip() if update_string else None
-
-    @staticmethod
-    def parse_downloads(downloads_text):
-        if downloads_text:
-            return downloads_text.strip()
-        return None
-
-
+        self.query_finished(response.meta.get('dockerhub_image'), 'scraped')
+        yield extract_image_item(response)
+
+    def parse_api_tags(self, response, repository):
+        for item in super().parse_api_tags(response, repository):
+            if isinstance(item, DockerImageItem):
+                self.query_finished(response.meta['dockerhub_image'], 'scraped')
+            yield item
+
+    def is_changed(self, name, last_update):
+        changed = super().is_changed(name, last_update)
+        if not changed:
+            self.query_finished(name, 'unchanged')
+        return changed
+
+    def browser_errback(self, failure):
+        self.query_finished(failure.request.meta.get('dockerhub_image'), 'failed')
+        self.logger.error(f"Could not render {failure.request.url}: {failure.value!r}")
+
+    def query_finished(self, name, outcome):
+        # a name is counted once, e.g. when a page is rendered again after a retry
+        if not name or name in self.finished:
+            return
+        self.finished[name] = outcome
+        self.crawler.stats.inc_value(f'dockerhub_queries/{outcome}')
+        self.crawler.stats.set_value(f'dockerhub_queries/by_query/{name}', outcome)
+        self.logger.info(f"{name}: {outcome} ({len(self.finished)}/{len(self.queries)} queries finished)")
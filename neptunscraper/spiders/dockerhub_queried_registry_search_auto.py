@@ -1,10 +1,19 @@
 import scrapy
 from scrapy.utils import spider
-from scrapy_playwright.page import PageMethod
-from neptunscraper.items import DockerImageItem
-
-
-class DockerhubDockerRegistrySearchSpider(spider.Spider):
+from neptunscraper import helpers
+from neptunscraper.delta import DeltaCrawlMixin
+from neptunscraper.dockerhub_api import (
+    DockerHubApiMixin,
+    image_name_from_path,
+    image_page_url,
+    search_pages,
+    search_result_count,
+    search_url,
+)
+from neptunscraper.extractors import extract_image_item
+
+
+class DockerhubDockerRegistrySearchSpider(DeltaCrawlMixin, DockerHubApiMixin, spider.Spider):
     name = "dockerhubDockerQueriedRegistrySearchSpider"
     allowed_domains = ["hub.docker.com"]
     custom_settings = {
@@ -13,133 +22,123 @@ class DockerhubDockerRegistrySearchSpider(spider.Spider):
         }
     }
 
-    def __init__(self, query=None, depth=None, *args, **kwargs):
+    def __init__(self, query=None, depth=None, mode=None, *args, **kwargs):
         super(DockerhubDockerRegistrySearchSpider, self).__init__(*args, **kwargs)
         self.query = query
-        self.depth = depth
-        self.start_urls = [f'https://hub.docker.com/search']
+        # the number of search pages followed after the first one, all of them by default
+        self.depth = None if depth is None else int(depth)
+        # "api" (JSON endpoints, the default) or "browser" (Playwright), see DOCKERHUB_DOWNLOAD_MODE
+        self.download_mode = mode
+        self.start_urls = [search_url(query, page=1)]
+        # queries whose pages were all scheduled from the result count of their first page
+        self.planned_queries = set()
 
     def start_requests(self):
+        if self.use_api():
+            yield self.api_search_request(self.query or '', page=1)
+            return
+
         for url in self.start_urls:
-            yield scrapy.Request(
-                url,
-                meta=dict(
-                    playwright=True,
-                    playwright_page_methods={
-                        "wait_for_search_results": PageMethod("wait_for_selector", "div#searchResults"),
-                    },
-                    current_page=1,
-                ),
-                callback=self.parse
-            )
+            yield self.search_request(url, page=1)
+
+    def browser_fallback(self, request):
+        if 'dockerhub_image' in request.meta:
+            return self.registry_request(image_page_url(request.meta['dockerhub_image']))
+        search = request.meta['dockerhub_search']
+        return self.search_request(search_url(search['query'], search['page']), page=search['page'])
+
+    def parse_api_search_results(self, response, data):
+        yield from super().parse_api_search_results(response, data)
+
+        search = response.meta['dockerhub_search']
+        pages = self.plan_pages(search['query'], search['page'], data.get('count'),
+                                self.settings.getint('DOCKERHUB_SEARCH_PAGE_SIZE', 25))
+        if pages is None and data.get('next') and self.follows_page(search['page'] + 1):
+            pages = [search['page'] + 1]
+        for page in pages or ():
+            yield self.api_search_request(search['query'], page=page)
+
+    def plan_pages(self, query, page, total, page_size):
+        """Pages to schedule at once after the first page of a query, None if they are unknown.
+
+        The pages are scheduled from the result count on the first page, so they wait
+        for their download slot instead of for the previous page: API pages are downloaded
+        concurrently (DOWNLOAD_SLOTS), rendered pages one at a time as fast as the throttle
+        of the browser allows. Without a count the pages are followed one by one.
+        """
+        if query in self.planned_queries:
+            return []
+        if page != 1 or total is None:
+            return None
+        self.planned_queries.add(query)
+        pages = search_pages(total, page_size, self.depth, self.settings.getint('DOCKERHUB_SEARCH_MAX_PAGES', 0))
+        self.crawler.stats.inc_value('dockerhub_search/planned_pages', len(pages))
+        self.logger.info(f"Scheduling {len(pages)} more search pages for {total} results of {query!r}")
+        return pages
+
+    def follows_page(self, page):
+        return self.depth is None or page <= 1 + self.depth
+
+    def search_request(self, url, page):
+        return scrapy.Request(
+            url,
+            meta=dict(
+                playwright=True,
+                playwright_page_methods={
+                    "wait_for_search_results": helpers.page_method("wait_for_selector", "div#searchResults"),
+                },
+                current_page=page,
+            ),
+            callback=self.parse
+        )
+
+    def registry_request(self, url, last_update=None):
+        return scrapy.Request(
+            url=url,
+            meta=dict(
+                playwright=True,
+                playwright_page_methods={
+                    "wait_for_selector_repo_name": helpers.page_method("wait_for_selector",
+                                                                       'body[aria-describedby="global-progress"]'),
+                    "wait_for_selector_tag_list": helpers.page_method("wait_for_selector", 'div[data-testid="repotagsTagList"]'),
+
+                },
+            ),
+            callback=self.parse_registry,
+            cb_kwargs=dict(last_update=last_update),
+        )
 
     def parse(self, response):
         self.logger.info("Processing page: %s", response.url)
 
-        image_links = response.css('a[data-testid="imageSearchResult"]::attr(href)').getall()
-
-        for link in image_links:
-            yield scrapy.Request(
-                    url=f"https://hub.docker.com{link}/tags",
-                    meta=dict(
-                        playwright=True,
-                        playwright_page_methods={
-                            "wait_for_selector_repo_name": PageMethod("wait_for_selector",
-                                                                      'body[aria-describedby="global-progress"]'),
-                            "wait_for_selector_tag_list": PageMethod("wait_for_selector", 'div[data-testid="repotagsTagList"]'),
-
-                        },
-                    ),
-                    callback=self.parse_registry,
-                )
-
-        if 'current_page' in response.meta and (self.depth is None or response.meta['current_page'] <= self.depth):
-            current_page = response.meta['current_page']
-            next_page = current_page + 1
-
-            next_button_exists = response.xpath('//li[@data-testid="pagination-next"]')
-
-            if next_button_exists:
-                yield scrapy.Request(
-                    url=f"https://hub.docker.com/search?q=python&page={next_page}",
-                    meta=dict(
-                        playwright=True,
-                        playwright_page_methods={
-                            "wait_for_search_results": PageMethod("wait_for_selector", "div#searchResults"),
-                        },
-                        current_page=next_page,
-                    ),
-                    callback=self.parse,
-                )
+        cards = response.css('a[data-testid="imageSearchResult"]')
+        for card in cards:
+            link = card.attrib.get('href')
+            if not link:
+                continue
+            # the card tells when the image was updated, unchanged images are skipped in a delta crawl
+            last_update = card.xpath('.//span[contains(text(), "Updated")]/text()').get()
+            last_update = last_update.strip() if last_update else None
+            if not self.is_changed(image_name_from_path(link), last_update):
+                continue
+            yield self.registry_request(f"https://hub.docker.com{link}/tags", last_update=last_update)
+
+        current_page = response.meta.get('current_page', 1)
+        pages = self.plan_pages(self.query or '', current_page, search_result_count(response), len(cards))
+        if pages is None and self.follows_page(current_page + 1):
+            if response.xpath('//li[@data-testid="pagination-next"]'):
+                pages = [current_page + 1]
             else:
                 self.logger.info("No more pages to scrape.")
-
-    def parse_registry(self, response):
-        item = DockerImageItem()
-
-        name = response.css('h1.MuiTypography-h2::text, h2.MuiTypography-h2::text').get()
-        item['name'] = name.strip() if name else None
-
-        verified_publisher_icon = response.css('svg[data-testid="official-icon"]')
-        item["is_verified_publisher"] = bool(verified_publisher_icon)
-
-        # Extract downloads
-        downloads_elem = response.css('svg[data-testid="DownloadIcon"] + p.MuiTypography-body1::text').get()
-        item['downloads'] = downloads_elem if downloads_elem else response.css(
-            'p.MuiTypography-body1:nth-child(3)::text').get()
-
-        if len(str(item['downloads'])) > 4:
-            item['downloads'] = None if downloads_elem else response.css(
-                'p.MuiTypography-body1:nth-child(4)::text').get()
-
-            if item['downloads'] is None:
-                item['downloads'] = response.css('p.MuiTypography-body1:nth-child(5)::text').get()
-
-        description = response.css('p[data-testid="description"]::text').get()
-
-        if not description:
-            description = response.css('p.MuiTypography-body1:nth-child(3)::text').get()
-            if str(item['downloads']) in str(description):
-                description = None
-        item['description'] = description
-
-        # Chips (Tags)
-        item['chips'] = [chip.strip() for chip in response.css('span.MuiChip-labelSmall::text').getall() if
-                         chip.strip().lower() not in ["new", "image"]]
-
-        stars_text = response.css('svg[data-testid="StarOutlineIcon"] + span.MuiTypography-body1 strong::text').get()
-        item['stars'] = stars_text.strip() if stars_text else None
-
-        tags = {}
-
-        tag_items = response.css('div[data-testid="repotagsTagListItem"]')
-        for tag_item in tag_items:
-            tag_name = tag_item.css('a[data-testid="navToImage"]::text').get()
-
-            if tag_name:
-                tag_version = self.extract_type_and_version(tag_name)
-                if tag_version:
-                    type_name, version = tag_version
-                    tags.setdefault(version, []).append(type_name)
-                else:
-                    tags.setdefault('default', []).append(tag_name)
-            else:
-                tags.setdefault('default', []).append("")
-
-        formatted_tags = {}
-        for key, values in tags.items():
-            formatted_tags[key] = values
-
-            item['tags'] = formatted_tags
-        yield item
-
-    def extract_type_and_version(self, tag_name):
-        if tag_name and '-' in tag_name:
-            parts = tag_name.rsplit('-', 1)
-            if len(parts) == 2:
-                return parts[0], parts[1]
-
-        return None
+        for page in pages or ():
+            yield self.search_request(search_url(self.query, page), page)
+
+    def parse_registry(self, response, last_update=None):
+        yield extract_image_item(
+            response,
+            last_update=last_update,
+            last_updated_at=helpers.update_timestamp(last_update),
+        )
 
     def close(spider, reason):
         spider.logger.info(f"Spider closed: {spider.name}, due to {reason}")
@@ -1,12 +1,13 @@
 import scrapy
 from scrapy.spiders import Rule, CrawlSpider
-from scrapy_playwright.page import PageMethod
-from scrapy.crawler import CrawlerProcess
 from scrapy.linkextractors import LinkExtractor
+from neptunscraper import helpers
+from neptunscraper.delta import DeltaCrawlMixin
+from neptunscraper.dockerhub_api import image_name_from_path, search_pages, search_result_count, search_url
 from neptunscraper.items import DockerImageItem
 
 
-class DockerhubDockerRegistrySpider(CrawlSpider):
+class DockerhubDockerRegistrySpider(DeltaCrawlMixin, CrawlSpider):
     name = "dockerhubDockerQueriedRegistrySearchSpiderTemp"
     allowed_domains = ["hub.docker.com"]
 
@@ -25,34 +26,32 @@ class DockerhubDockerRegistrySpider(CrawlSpider):
 
     )
 
-    def __init__(self, query=None, *args, **kwargs):
+    def __init__(self, query=None, depth=10, *args, **kwargs):
         super(DockerhubDockerRegistrySpider, self).__init__(*args, **kwargs)
         self.query = query
-        self.start_urls = [f'https://hub.docker.com/search?q={query}&page={i}' for i in range(1, 12)]
+        # the number of search pages followed after the first one
+        self.depth = int(depth)
+        self.start_urls = [search_url(query, page=1)]
 
     def start_requests(self):
-        for index, url in enumerate(self.start_urls, start=1):
+        for url in self.start_urls:
             self.logger.info(f"Starting request: {url}")
-            yield scrapy.Request(
-                    url,
-                    meta=dict(
-                        page_number=index,
-                        playwright=True,
-                        playwright_include_page=True,
-                        playwright_page_methods={
-                            "wait_for_search_results": PageMethod("wait_for_selector", "div#searchResults"),
-                        }
-                    ),
-                    callback=self.parse_registry
-                )
-
-    async def parse_registry(self, response):
-        page = response.meta["playwright_page"]
-
-        if await page.title() == "hub.docker.com":
-            await page.close()
-            await page.context.close()
+            yield self.search_request(url, 1)
+
+    def search_request(self, url, page_number):
+        return scrapy.Request(
+                url,
+                meta=dict(
+                    page_number=page_number,
+                    playwright=True,
+                    playwright_page_methods={
+                        "wait_for_search_results": helpers.page_method("wait_for_selector", "div#searchResults"),
+                    }
+                ),
+                callback=self.parse_registry
+            )
 
+    def parse_registry(self, response):
         page_number = response.meta.get("page_number")
         if page_number is None:
             self.logger.warning("Page number not found in meta: %s", response.url)
@@ -60,9 +59,19 @@ class DockerhubDockerRegistrySpider(CrawlSpider):
 
         search_results = response.xpath('//a[@data-testid="imageSearchResult"]')
 
+        if page_number == 1:
+            # the other pages are scheduled at once, up to the last one with results
+            total = search_result_count(response)
+            if total is None:
+                pages = range(2, 2 + self.depth)
+            else:
+                pages = search_pages(total, len(search_results), self.depth,
+                                     self.settings.getint('DOCKERHUB_SEARCH_MAX_PAGES', 0))
+            for page in pages:
+                yield self.search_request(search_url(self.query, page), page)
+
         for result in search_results:
             item = DockerImageItem()
-            item['page_number'] = page_number
             item['name'] = result.css('[data-testid="product-title"]::text').get()
 
             uploader_elem = result.css("span::text").re(r"^By (.+)")
@@ -81,6 +90,7 @@ class DockerhubDockerRegistrySpider(CrawlSpider):
             item['is_official_image'] = bool(result.css('[data-testid="official-icon"]'))
             item['is_verified_publisher'] = bool(result.css('[data-testid="verified_publisher-icon"]'))
             item['last_update'] = self.parse_update_string(result.css('span:contains("Updated")::text').get())
+            item['last_updated_at'] = helpers.update_timestamp(item['last_update'])
 
             item['description'] = result.xpath(
                 './/span[contains(text(), "Updated")]/ancestor::div[1]/following-sibling::p[1]/text()').get()
@@ -108,7 +118,11 @@ class DockerhubDockerRegistrySpider(CrawlSpider):
             item['stars'] = item['stars'].strip() if item['stars'] else None
 
             additional_data_url = result.attrib.get('href')
-            if additional_data_url and '/r/' or '/_/' in additional_data_url and '/tags' in additional_data_url:
+            if additional_data_url and not self.is_changed(image_name_from_path(additional_data_url), item['last_update']):
+                # unchanged since the last crawl, the stored record stays as it is
+                continue
+
+            if additional_data_url and ('/r/' in additional_data_url or '/_/' in additional_data_url):
                 additional_data_url_absolute = f"https://hub.docker.com{additional_data_url}/tags"
                 self.logger.info("Entered Additional Page: %s", additional_data_url_absolute)
 
@@ -118,10 +132,8 @@ class DockerhubDockerRegistrySpider(CrawlSpider):
                     cb_kwargs=dict(item=item),
                     meta=dict(
                         playwright=True,
-                        playwright_include_page=True,
-                        errback=self.close_context_on_error,
                         playwright_page_methods={
-                            "wait_for_page_load": PageMethod("wait_for_selector", 'div[data-testid="repotagsTagListItem"]'),
+                            "wait_for_page_load": helpers.page_method("wait_for_selector", 'div[data-testid="repotagsTagListItem"]'),
                         },
                         playwright_context_kwargs={
                             "ignore_https_errors": True,
@@ -132,17 +144,11 @@ class DockerhubDockerRegistrySpider(CrawlSpider):
                 self.logger.error("No additional page available for: %s", item['name'])
                 yield item
 
-    async def close_context_on_error(self, failure):
-        page = failure.request.meta["playwright_page"]
-        await page.close()
-        await page.context.close()
-
     def parse_additional_page(self, response, item):
 
         self.logger.info("Additional page meta: %s", response.meta)
         self.logger.info("Additional page HTML: %s", response.css('title::text').get())
         self.logger.info("Additional page HTML Repo-Name: %s", response.css('h2[data-testid="repoName"]::text').get())
-        item['additional_data'] = response.css('h2[data-testid="repoName"]::text').get()
         return item
 
 
@@ -152,11 +158,17 @@ class DockerhubDockerRegistrySpider(CrawlSpider):
 
 
 if __name__ == "__main__":
+    from scrapy.crawler import CrawlerProcess
+
     query = "python"  # Replace with your query
     output_dir = "output"
     process = CrawlerProcess(settings={
-        'FEED_FORMAT': 'json',
-        'FEED_URI': 'output/output.json',
+        'FEEDS': {
+            'output/output.parquet': {
+                'format': 'parquet',
+                'item_classes': ['neptunscraper.items.DockerImageItem'],
+            },
+        },
         'LOG_LEVEL': 'INFO',
         'PLAYWRIGHT_INCLUDE_PATH': True,  # Ensure Playwright is included in the path
         'PLAYWRIGHT_BROWSER': 'chromium',  # Specify the browser to use (chromium or firefox)
@@ -0,0 +1,297 @@
+# Append-only on-disk spool for pipeline writes.
+#
+# Records are JSON documents framed as <length><crc32><payload>. They are appended
+# to an ".open" segment, which is renamed to ".seg" once it is sealed. Sealed
+# segments are replayed into the database by a SpoolDrainer (or by the
+# `scrapy replayspool` command after a crash) and removed once written.
+#
+# Every process spools into its own job directory and holds a lock on it, so
+# concurrent jobs of a spider (scrapyd max_proc, the scrapyd and scrapyrt containers,
+# several crawl workers) never seal or drain each other's segments. The segments of
+# a job directory whose lock is free were left behind and are adopted by the next job.
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import socket
+import struct
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct('>II')
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+FAILED_DIR = 'failed'
+LOCK_FILE = '.lock'
+
+
+def read_segment(path):
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER.size:
+                logger.warning(f"Ignoring truncated record header at the end of {path}")
+                return
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                # a crash while appending leaves a partial last record behind
+                logger.warning(f"Ignoring corrupt record at the end of {path}")
+                return
+            yield json.loads(payload)
+
+
+def seal_open_segments(directory):
+    # segments left open by a crashed process are sealed as they are, read_segment skips a torn tail
+    for name in os.listdir(directory):
+        if name.endswith(OPEN_SUFFIX):
+            path = os.path.join(directory, name)
+            os.replace(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+
+
+def find_segments(directory):
+    segments = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SEALED_SUFFIX)]
+    return sorted(segments, key=os.path.basename)
+
+
+def lock_directory(directory, blocking=True):
+    """Open lock file of the directory, None if another process holds the lock."""
+    lock = open(os.path.join(directory, LOCK_FILE), 'a+b')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+def segment_directories(directory):
+    # every directory holding segments, e.g. the job directories below SPOOL_DIR
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [name for name in dirs if name != FAILED_DIR]
+        if any(name.endswith((OPEN_SUFFIX, SEALED_SUFFIX)) for name in files):
+            yield root
+
+
+def default_job():
+    # scrapyd sets SCRAPY_JOB, containers sharing the spool may have the same pids
+    return os.environ.get('SCRAPY_JOB') or f'{socket.gethostname()}-{os.getpid()}'
+
+
+class Spool:
+    """Segments of one job in `directory`/`job`, which is locked until `close()`."""
+
+    def __init__(self, directory, fsync=False, job=None):
+        self.root = directory
+        self.directory = os.path.join(directory, job or default_job())
+        self.fsync = fsync
+        self.active = None
+        self.active_path = None
+        self.active_records = 0
+        self.active_since = None
+        self.sequence = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = lock_directory(self.directory, blocking=False)
+        if self.lock is None:
+            raise RuntimeError(f"The spool {self.directory} is used by another process")
+        seal_open_segments(self.directory)
+        self.adopt_abandoned()
+
+    def adopt_abandoned(self):
+        # one process at a time, the lock of the root is only held while adopting
+        root_lock = lock_directory(self.root)
+        try:
+            # segments in the root itself were written before the spool had job directories
+            seal_open_segments(self.root)
+            self.take_segments(self.root)
+            for entry in os.scandir(self.root):
+                if entry.is_dir() and entry.path != self.directory and entry.name != FAILED_DIR:
+                    self.adopt(entry.path)
+        finally:
+            root_lock.close()
+
+    def adopt(self, directory):
+        lock = lock_directory(directory, blocking=False)
+        if lock is None:
+            # the job is still running
+            return
+        try:
+            seal_open_segments(directory)
+            self.take_segments(directory)
+            os.remove(os.path.join(directory, LOCK_FILE))
+            remove_empty(directory)
+        finally:
+            lock.close()
+
+    def take_segments(self, directory):
+        segments = find_segments(directory)
+        for path in segments:
+            os.replace(path, os.path.join(self.directory, os.path.basename(path)))
+        if segments:
+            logger.info(f"Adopted {len(segments)} segments left in {directory}")
+
+    def close(self):
+        # a job directory with segments left is adopted by the next job
+        if self.active is not None:
+            self.seal()
+        if not find_segments(self.directory):
+            os.remove(os.path.join(self.directory, LOCK_FILE))
+            remove_empty(self.directory)
+        self.lock.close()
+
+    def append(self, record):
+        if self.active is None:
+            name = f'{time.time_ns():020d}-{os.getpid()}-{self.sequence:06d}'
+            self.sequence += 1
+            self.active_path = os.path.join(self.directory, name + OPEN_SUFFIX)
+            self.active = open(self.active_path, 'ab')
+            self.active_since = time.monotonic()
+
+        payload = json.dumps(record, ensure_ascii=False, default=str).encode('utf-8')
+        self.active.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self.active.write(payload)
+        # hand the record to the OS right away, so it survives a crash of the crawler
+        self.active.flush()
+        self.active_records += 1
+
+    def active_age(self):
+        return time.monotonic() - self.active_since if self.active is not None else 0.0
+
+    def seal(self):
+        if self.active is None:
+            return None
+
+        if self.fsync:
+            os.fsync(self.active.fileno())
+        self.active.close()
+        sealed_path = self.active_path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX
+        os.replace(self.active_path, sealed_path)
+        self.active = None
+        self.active_path = None
+        self.active_records = 0
+        self.active_since = None
+        return sealed_path
+
+    def sealed_segments(self):
+        return find_segments(self.directory)
+
+    def quarantine(self, path):
+        # shared by the jobs, segment names are unique
+        failed_dir = os.path.join(self.root, FAILED_DIR)
+        os.makedirs(failed_dir, exist_ok=True)
+        shutil.move(path, os.path.join(failed_dir, os.path.basename(path)))
+
+
+def remove_empty(directory):
+    try:
+        os.rmdir(directory)
+    except OSError:
+        # not empty, missing, or a new job created its lock file in the meantime
+        pass
+
+
+class SpoolDrainer:
+    """Replays sealed segments through `write(records)` in the background.
+
+    Producers call `wait_for_capacity()`, which blocks while `max_pending` segments
+    are waiting, so a slow or unavailable database throttles the crawl instead of
+    filling the disk. Errors listed in `transient_errors` are retried until the
+    drainer is stopped; any other error moves the segment to the failed directory
+    after `max_retries` attempts.
+    """
+
+    def __init__(self, spool, write, stats, stats_prefix, max_pending=20, max_retries=5,
+                 retry_delay=1.0, max_retry_delay=60.0, transient_errors=()):
+        self.spool = spool
+        self.write = write
+        self.stats = stats
+        self.stats_prefix = stats_prefix
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.transient_errors = tuple(transient_errors)
+        self.pending = spool.sealed_segments()
+        self.changed = asyncio.Condition()
+        self.stopping = False
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def notify(self, path=None):
+        async with self.changed:
+            if path is not None:
+                self.pending.append(path)
+            self.changed.notify_all()
+
+    async def wait_for_capacity(self):
+        if self.max_pending <= 0:
+            return
+        async with self.changed:
+            await self.changed.wait_for(lambda: len(self.pending) < self.max_pending or self.task.done())
+
+    async def stop(self):
+        self.stopping = True
+        await self.notify()
+        await self.task
+        if self.pending:
+            logger.warning(
+                f"{len(self.pending)} segments left in {self.spool.directory}, "
+                f"write them with `scrapy replayspool`"
+            )
+
+    async def run(self):
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.pending or self.stopping)
+                if not self.pending:
+                    return
+                path = self.pending[0]
+
+            if not await self.drain(path):
+                # only happens while stopping, the segment stays on disk for a replay
+                return
+
+            async with self.changed:
+                self.pending.pop(0)
+                self.changed.notify_all()
+
+    async def drain(self, path):
+        records = list(read_segment(path))
+        delay = self.retry_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.monotonic()
+            try:
+                if records:
+                    await self.write(records)
+                break
+            except Exception as e:
+                self.stats.inc_value(f'{self.stats_prefix}/flush_errors')
+                logger.error(f"Error writing {len(records)} spooled items from {path} (attempt {attempt}): {e}")
+                if self.stopping:
+                    return False
+                if not isinstance(e, self.transient_errors) and attempt >= self.max_retries:
+                    self.stats.inc_value(f'{self.stats_prefix}/segments_failed')
+                    self.spool.quarantine(path)
+                    return True
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+        latency_ms = (time.monotonic() - started) * 1000
+        self.stats.inc_value(f'{self.stats_prefix}/flush_count')
+        self.stats.inc_value(f'{self.stats_prefix}/flushed_items', len(records))
+        self.stats.max_value(f'{self.stats_prefix}/flush_size_max', len(records))
+        self.stats.inc_value(f'{self.stats_prefix}/flush_latency_ms_total', round(latency_ms))
+        self.stats.max_value(f'{self.stats_prefix}/flush_latency_ms_max', round(latency_ms))
+        os.remove(path)
+        return True
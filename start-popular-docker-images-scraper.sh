@@ -39,7 +39,7 @@ queries=(
 
 )
 
-for query in "${queries[@]}"; do
-  echo "Running Scrapy for Docker image: $query"
-  scrapy crawl dockerhubQueriedRegistrySpider -a query="$query"
-done
+echo "Running Scrapy for ${#queries[@]} Docker images"
+# one crawl for all images, they share the browser and the database connections;
+# only fetches the tags of images that were updated since the last run
+scrapy crawl dockerhubQueriedRegistrySpider -a queries="$(IFS=,; echo "${queries[*]}")" -a delta=1